@@ -0,0 +1,74 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+
+def token_cache_key(key):
+    # Hashed so the raw tokens never end up in a shared (file) cache
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_cached_keys(keys):
+    # Dropped once the change is committed: a request authenticating before that would cache the old rows again
+    cache_keys = [token_cache_key(key) for key in keys]
+    transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+
+def invalidate_cached_tokens(user):
+    invalidate_cached_keys(Token.objects.filter(user=user).values_list('key', flat=True))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # Token authentication that caches the resolved user, including its moderator status, for
+    # AUTH_TOKEN_CACHE_TTL seconds. Views changing a user or its token must call invalidate_cached_tokens.
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            user.is_moderator = user.is_staff or user.groups.filter(name='Moderators').exists()
+            cached = (user, token)
+            cache.set(cache_key, cached, settings.AUTH_TOKEN_CACHE_TTL)
+
+        user, token = cached
+        if user.is_banned:
+            raise exceptions.AuthenticationFailed('Account is banned.')
+        return user, token
+
+
+async def aauthenticate(request):
+    # Async counterpart of CachedTokenAuthentication.authenticate for the async views, sharing its cache entries.
+    # Returns None without an Authorization: Token header and raises AuthenticationFailed on a bad token.
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() != b'token':
+        return None
+    if len(auth) != 2:
+        raise exceptions.AuthenticationFailed('Invalid token header.')
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+    cache_key = token_cache_key(key)
+    cached = await cache.aget(cache_key)
+    if cached is None:
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        user = token.user
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        user.is_moderator = user.is_staff or await user.groups.filter(name='Moderators').aexists()
+        cached = (user, token)
+        await cache.aset(cache_key, cached, settings.AUTH_TOKEN_CACHE_TTL)
+
+    user, token = cached
+    if user.is_banned:
+        raise exceptions.AuthenticationFailed('Account is banned.')
+    return user, token
@@ -3,7 +3,10 @@ from rest_framework import permissions
 
 class IsModerator(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.is_authenticated and (
-                request.user.is_staff or
-                request.user.groups.filter(name='Moderators').exists()
-        )
+        if not request.user.is_authenticated:
+            return False
+        # Resolved once by CachedTokenAuthentication, the groups query only runs for other authenticators
+        is_moderator = getattr(request.user, 'is_moderator', None)
+        if is_moderator is None:
+            is_moderator = request.user.is_staff or request.user.groups.filter(name='Moderators').exists()
+        return is_moderator
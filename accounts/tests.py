@@ -0,0 +1,31 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.authentication import token_cache_key
+from accounts.models import CustomUser
+
+
+@override_settings(AUTH_TOKEN_CACHE_TTL=300)
+class CachedTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(username='customer', email='customer@example.com', password='password')
+        self.key = Token.objects.create(user=user).key
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+
+    def test_logout_drops_the_cached_token_on_commit(self):
+        self.assertEqual(self.client.get('/auth/profile/').status_code, 200)
+        self.assertIsNotNone(cache.get(token_cache_key(self.key)))
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertEqual(self.client.post('/auth/logout/').status_code, 200)
+            # Deleted from the database first, from the cache once that is committed
+            self.assertFalse(Token.objects.filter(key=self.key).exists())
+            self.assertIsNotNone(cache.get(token_cache_key(self.key)))
+        self.assertEqual(len(callbacks), 1)
+
+        self.assertIsNone(cache.get(token_cache_key(self.key)))
+        self.assertEqual(self.client.get('/auth/profile/').status_code, 401)
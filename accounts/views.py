@@ -1,11 +1,11 @@
 from django.contrib.auth.decorators import login_required
 from django.db.models.functions import datetime
 from rest_framework import status, generics
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.response import Response
 
+from accounts.authentication import CachedTokenAuthentication, invalidate_cached_keys, invalidate_cached_tokens
 from accounts.permissions import IsModerator
 from .models import CustomUser
 from .serializers import UserRegistrationSerializer, UserSerializer, UserLoginSerializer
@@ -41,9 +41,12 @@ def login_view(request):
 
 @api_view(['POST'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 def logout_view(request):
-    request.user.auth_token.delete()
+    token = request.user.auth_token
+    key = token.key
+    token.delete()
+    invalidate_cached_keys([key])
     return Response({'message': 'Logged out successfully'}, status=status.HTTP_200_OK)
 
 
@@ -52,12 +55,12 @@ class ListUsersView(generics.ListAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsModerator]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
 
 
 @api_view(['GET'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsModerator])
 def get_user(request, pk):
     user = CustomUser.objects.get(pk=pk)
@@ -68,7 +71,7 @@ def get_user(request, pk):
 
 @api_view(['GET'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 def get_own_profile(request):
     user = request.user
     serializer = UserSerializer(user)
@@ -77,7 +80,7 @@ def get_own_profile(request):
 
 @api_view(['PUT'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 def update_user(request):
     user = request.user
 
@@ -109,6 +112,7 @@ def update_user(request):
         user.date_of_birth = date_of_birth
 
     user.save()
+    invalidate_cached_tokens(user)
 
     return Response({
         'message': 'User updated successfully',
@@ -118,7 +122,7 @@ def update_user(request):
 
 @api_view(['PUT'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsModerator])
 def ban_user(request):
     username = request.data.get('username')
@@ -139,13 +143,14 @@ def ban_user(request):
     user_to_ban.is_banned = True
     user_to_ban.updated_at = datetime.datetime.now()
     user_to_ban.save()
+    invalidate_cached_tokens(user_to_ban)
 
     return Response({'message': f'User {username} banned successfully'}, status=status.HTTP_200_OK)
 
 
 @api_view(['PUT'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsModerator])
 def unban_user(request):
     username = request.data.get('username')
@@ -163,6 +168,7 @@ def unban_user(request):
     user_to_unban.is_banned = False
     user_to_unban.updated_at = datetime.datetime.now()
     user_to_unban.save()
+    invalidate_cached_tokens(user_to_unban)
     return Response({'message': f'User {username} unbanned successfully'}, status=status.HTTP_200_OK)
 
 
@@ -0,0 +1,18 @@
+from asgiref.sync import sync_to_async
+
+from cart import store as cart_store
+from cart.models import Cart
+from cart.serializers import CartItemSerializer
+from ecommerce_api.async_api import async_api_view, json_response
+
+
+# Async version of get_cart, served by the ASGI application (see ecommerce_api/urls_asgi.py)
+
+@async_api_view(login_required=True)
+async def get_cart(request):
+    if cart_store.enabled():
+        return json_response(await sync_to_async(cart_store.get_items)(request.user.pk))
+    cart, created = await Cart.objects.aget_or_create(user=request.user)
+    cart_items = [item async for item in cart.items.select_related('product__category')]
+    serializer = CartItemSerializer(cart_items, many=True)
+    return json_response(serializer.data)
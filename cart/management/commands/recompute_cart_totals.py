@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from cart.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored totals of every cart from its lines, in batches of carts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of carts updated by each UPDATE statement.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        while True:
+            pks = list(Cart.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            updated += Cart.recompute_totals(Cart.objects.filter(pk__in=pks))
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f'Recomputed the totals of {updated} carts.'))
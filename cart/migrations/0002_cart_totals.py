@@ -0,0 +1,54 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_totals(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    lines = CartItem.objects.using(db).filter(cart=OuterRef('pk')).order_by().values('cart')
+
+    def line_sum(expression, output_field):
+        return Coalesce(Subquery(lines.annotate(total=Sum(expression)).values('total'), output_field=output_field),
+                        0, output_field=output_field)
+
+    amount = line_sum(F('discounted_price') * F('quantity'), models.DecimalField())
+    original = line_sum(F('product__price') * F('quantity'), models.DecimalField())
+    Cart.objects.using(db).update(
+        total_amount=amount,
+        original_total=original,
+        total_savings=original - amount,
+        item_count=line_sum(F('quantity'), models.PositiveIntegerField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='original_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_savings',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+from importlib import import_module
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+
+compute_totals = import_module('cart.migrations.0002_cart_totals').compute_totals
+
+
+def attach_lines(apps, schema_editor):
+    # Points every line at the cart of its join row. Lines shared by several carts are copied into
+    # each of them, lines repeating a product in the same cart are merged and lines of no cart dropped.
+    db = schema_editor.connection.alias
+    CartItem = apps.get_model('cart', 'CartItem')
+    Membership = apps.get_model('cart', 'Cart').items.through
+
+    CartItem.objects.using(db).update(cart_id=Subquery(
+        Membership.objects.using(db).filter(cartitem_id=OuterRef('pk')).order_by('pk').values('cart_id')[:1]))
+    CartItem.objects.using(db).bulk_create(
+        CartItem(cart_id=membership.cart_id, product_id=membership.cartitem.product_id,
+                 quantity=membership.cartitem.quantity, discounted_price=membership.cartitem.discounted_price,
+                 discount_applied=membership.cartitem.discount_applied)
+        for membership in Membership.objects.using(db).filter(~Q(cart_id=F('cartitem__cart_id')))
+        .select_related('cartitem'))
+    CartItem.objects.using(db).filter(cart_id=None).delete()
+
+    duplicates = (CartItem.objects.using(db).values('cart_id', 'product_id')
+                  .annotate(lines=Count('id'), total_quantity=Sum('quantity')).filter(lines__gt=1))
+    for duplicate in duplicates:
+        lines = CartItem.objects.using(db).filter(cart_id=duplicate['cart_id'], product_id=duplicate['product_id'])
+        kept = lines.order_by('pk').first()
+        lines.exclude(pk=kept.pk).delete()
+        CartItem.objects.using(db).filter(pk=kept.pk).update(quantity=duplicate['total_quantity'])
+
+
+def detach_lines(apps, schema_editor):
+    db = schema_editor.connection.alias
+    CartItem = apps.get_model('cart', 'CartItem')
+    Membership = apps.get_model('cart', 'Cart').items.through
+    Membership.objects.using(db).bulk_create(
+        Membership(cart_id=cart_id, cartitem_id=pk)
+        for pk, cart_id in CartItem.objects.using(db).values_list('pk', 'cart_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_totals'),
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='cart',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                    to='cart.cart'),
+        ),
+        migrations.RunPython(attach_lines, detach_lines),
+        migrations.RemoveField(
+            model_name='cart',
+            name='items',
+        ),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='cart',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items',
+                                    to='cart.cart'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cart_cartitem_unique_product'),
+        ),
+        # Merged lines may have had different discounted prices
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
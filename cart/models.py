@@ -1,25 +1,97 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import connection, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 
 from accounts.models import CustomUser
 from products.models import Product, Category
 
 
+class Cart(models.Model):
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='cart')
+    # Running totals, kept up to date by every cart mutation so reading a cart never walks its lines
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    original_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_savings = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Cart for {self.user}"
+
+    def add_to_totals(self, amount=0, original=0, count=0):
+        # Applied with F() expressions so concurrent requests on the same cart don't lose updates
+        Cart.objects.filter(pk=self.pk).update(
+            total_amount=F('total_amount') + amount,
+            original_total=F('original_total') + original,
+            total_savings=F('total_savings') + (original - amount),
+            item_count=F('item_count') + count,
+        )
+        self.total_amount += amount
+        self.original_total += original
+        self.total_savings += original - amount
+        self.item_count += count
+
+    def reset_totals(self):
+        Cart.objects.filter(pk=self.pk).update(total_amount=0, original_total=0, total_savings=0, item_count=0)
+        self.total_amount = self.original_total = self.total_savings = Decimal('0.00')
+        self.item_count = 0
+
+    @classmethod
+    def recompute_totals(cls, carts=None):
+        # Rebuilds the stored totals from the cart lines with a single UPDATE over the given carts
+        lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+
+        def line_sum(expression, output_field):
+            return Coalesce(Subquery(lines.annotate(total=Sum(expression)).values('total'),
+                                     output_field=output_field), 0, output_field=output_field)
+
+        amount = line_sum(F('discounted_price') * F('quantity'), models.DecimalField())
+        original = line_sum(F('product__price') * F('quantity'), models.DecimalField())
+        carts = cls.objects.all() if carts is None else carts
+        return carts.update(
+            total_amount=amount,
+            original_total=original,
+            total_savings=original - amount,
+            item_count=line_sum(F('quantity'), models.PositiveIntegerField()),
+        )
+
+
+# One line per product of a cart
 class CartItem(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     discounted_price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_applied = models.BooleanField(default=False)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='cart_cartitem_unique_product'),
+        ]
+
     def __str__(self):
         return f"{self.product.name}: {self.quantity}x"
 
-
-class Cart(models.Model):
-    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='cart')
-    items = models.ManyToManyField(CartItem)
-
-    def __str__(self):
-        return f"Cart for {self.user}"
+    @classmethod
+    def add_quantity(cls, cart, product, quantity):
+        # Inserts the line or increments its quantity in one statement, atomic even against a concurrent
+        # request adding the same product. The line is left untouched if it would exceed the product stock.
+        # Returns the discounted price of the line, or None when the stock is insufficient.
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (cart_id, product_id, quantity, discounted_price, discount_applied) '
+                f'VALUES (%s, %s, %s, %s, %s) '
+                f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity '
+                f'WHERE {table}.quantity + excluded.quantity <= %s '
+                f'RETURNING discounted_price',
+                [cart.pk, product.pk, quantity, product.price, False, product.stock_quantity])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        # Raw rows skip the field converters, SQLite returns the price as a float
+        return Decimal(str(row[0])).quantize(Decimal('0.01'))
 
 
 class Discount(models.Model):
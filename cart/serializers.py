@@ -23,31 +23,14 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
-    total_amount = serializers.SerializerMethodField()
-    original_total = serializers.SerializerMethodField()
-    total_savings = serializers.SerializerMethodField()
+    # Stored on the cart and maintained by the cart views, see Cart.add_to_totals
+    total_amount = serializers.DecimalField(max_digits=12, decimal_places=2, coerce_to_string=False, read_only=True)
+    original_total = serializers.DecimalField(max_digits=12, decimal_places=2, coerce_to_string=False, read_only=True)
+    total_savings = serializers.DecimalField(max_digits=12, decimal_places=2, coerce_to_string=False, read_only=True)
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'total_amount', 'original_total', 'total_savings']
-
-    def get_total_amount(self, obj):
-        # Calculate total using discounted prices
-        total = 0
-        for item in obj.items.all():
-            price = item.discounted_price if item.discounted_price else item.product.price
-            total += price * item.quantity
-        return total
-
-    def get_original_total(self, obj):
-        # Calculate original total without discounts
-        return sum(item.product.price * item.quantity for item in obj.items.all())
-
-    def get_total_savings(self, obj):
-        # Calculate total savings
-        original = self.get_original_total(obj)
-        discounted = self.get_total_amount(obj)
-        return original - discounted
+        fields = ['id', 'user', 'items', 'total_amount', 'original_total', 'total_savings', 'item_count']
 
 
 class DiscountSerializer(serializers.ModelSerializer):
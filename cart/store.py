@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal
+from functools import wraps
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.http import Http404
+
+from cart.models import Cart, CartItem
+from cart.serializers import CartItemSerializer
+from products.cache import get_catalog_version, get_stock, with_stock
+from inventory import reservations
+from products.models import Product
+from products.serializers import ProductSerializer
+
+# Cache-backed cart store, enabled with CART_BACKEND=cache. The cart of a user lives in one cache entry that the cart
+# views read and change; changes are written back to the Cart tables by a background flush CART_FLUSH_DELAY seconds
+# later, and right away before any view that works on the cart tables (see write_back). A lost entry is rebuilt from
+# the tables, so at worst the changes of the last CART_FLUSH_DELAY seconds are lost, never mixed with older ones.
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+LOCK_TIMEOUT = 10
+
+
+def enabled():
+    return settings.CART_BACKEND == 'cache'
+
+
+def cart_key(user_id):
+    return f'cart:{user_id}'
+
+
+@contextmanager
+def locked(user_id):
+    # Serializes the changes to one cart across threads and, with a shared cache backend, across workers. Relies on
+    # add() being atomic, which settings.py checks for CART_BACKEND=cache. The lock expires on its own if its holder
+    # dies.
+    key = f'cart:{user_id}:lock'
+    while not cache.add(key, True, LOCK_TIMEOUT):
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def load(user_id):
+    entry = cache.get(cart_key(user_id))
+    if entry is None:
+        with locked(user_id):
+            entry = load_locked(user_id)
+    return entry
+
+
+def load_locked(user_id):
+    # load() for the callers holding the cart lock. Lines are stored as product id -> [line id, quantity, discounted
+    # price, discount applied], the line id is None until the line has been written to the database.
+    entry = cache.get(cart_key(user_id))
+    if entry is None:
+        cart, created = Cart.objects.get_or_create(user_id=user_id)
+        items = list(cart.items.select_related('product__category').order_by('pk'))
+        entry = {
+            'id': cart.pk,
+            'lines': {item.product_id: [item.pk, item.quantity, item.discounted_price, item.discount_applied]
+                      for item in items},
+            'dirty': False,
+        }
+        if reservations.enabled():
+            # A lost entry may have had lines never written back, their holds go with them
+            reservations.trim_cart(cart.pk, {item.product_id: item.quantity for item in items})
+        cache_products(item.product for item in items)
+        cache.set(cart_key(user_id), entry, settings.CART_CACHE_TTL)
+    return entry
+
+
+def save(user_id, entry):
+    entry['dirty'] = True
+    cache.set(cart_key(user_id), entry, settings.CART_CACHE_TTL)
+    schedule_flush(user_id)
+
+
+def product_key(version, product_id):
+    return f'catalog:{version}:product:{product_id}'
+
+
+def cache_products(products):
+    version = get_catalog_version()
+    data = {product.pk: ProductSerializer(product).data for product in products}
+    cache.set_many({product_key(version, product_id): product for product_id, product in data.items()},
+                   settings.CATALOG_CACHE_TTL)
+    return data
+
+
+def get_products(product_ids):
+    # Serialized products, cached under the catalog version so any catalog change refreshes them,
+    # with their current stock from the stock keys, which a sale drops without changing the version
+    version = get_catalog_version()
+    keys = {product_id: product_key(version, product_id) for product_id in product_ids}
+    cached = cache.get_many(keys.values())
+    products = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        products.update(cache_products(Product.objects.select_related('category').filter(pk__in=missing)))
+    stock = get_stock(version, list(products))
+    return {product['id']: product for product in with_stock(products.values(), stock)}
+
+
+def get_product(product_id):
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        raise Http404('No Product matches the given query.')
+    product = get_products([product_id]).get(product_id)
+    if product is None:
+        raise Http404('No Product matches the given query.')
+    return product
+
+
+def add_quantity(user_id, entry, product, quantity):
+    # Cache counterpart of CartItem.add_quantity, for the caller holding the cart lock. Returns None when the stock is
+    # insufficient.
+    line = entry['lines'].get(product['id'])
+    if line is None:
+        line = entry['lines'][product['id']] = [None, 0, Decimal(product['price']), False]
+    if line[1] + quantity > product['stock_quantity']:
+        if not line[1]:
+            del entry['lines'][product['id']]
+        return None
+    line[1] += quantity
+    save(user_id, entry)
+    return entry
+
+
+def quantity_in_cart(entry, product_id):
+    line = entry['lines'].get(product_id)
+    return line[1] if line else 0
+
+
+def items_data(entry):
+    # Same representation as CartItemSerializer on the database lines, skipping the products deleted since
+    products = get_products(list(entry['lines']))
+    lines = [SimpleNamespace(id=line_id, product=products[product_id], quantity=quantity,
+                             discounted_price=price, discount_applied=applied)
+             for product_id, (line_id, quantity, price, applied) in entry['lines'].items() if product_id in products]
+    return CartItemSerializer(lines, many=True).data
+
+
+def get_items(user_id):
+    return items_data(load(user_id))
+
+
+def cart_data(user_id, entry):
+    # Same representation as CartSerializer, the totals are computed from the lines at the current prices
+    items = items_data(entry)
+    amount = sum((Decimal(item['discounted_price']) * item['quantity'] for item in items), Decimal('0'))
+    original = sum((Decimal(item['product']['price']) * item['quantity'] for item in items), Decimal('0'))
+    return {
+        'id': entry['id'],
+        'user': user_id,
+        'items': items,
+        'total_amount': amount.quantize(CENT),
+        'original_total': original.quantize(CENT),
+        'total_savings': (original - amount).quantize(CENT),
+        'item_count': sum(item['quantity'] for item in items),
+    }
+
+
+def write(entry):
+    # Replaces the lines of the cart in the database with the cached ones and recomputes its totals
+    lines = entry['lines']
+    with transaction.atomic():
+        existing = set(Product.objects.filter(pk__in=lines).values_list('pk', flat=True))
+        items = [CartItem(cart_id=entry['id'], product_id=product_id, quantity=quantity,
+                          discounted_price=price, discount_applied=applied)
+                 for product_id, (line_id, quantity, price, applied) in lines.items() if product_id in existing]
+        CartItem.objects.filter(cart_id=entry['id']).exclude(product_id__in=existing).delete()
+        CartItem.objects.bulk_create(items, update_conflicts=True, unique_fields=['cart', 'product'],
+                                     update_fields=['quantity', 'discounted_price', 'discount_applied'])
+        Cart.recompute_totals(Cart.objects.filter(pk=entry['id']))
+    for product_id in set(lines) - existing:
+        del lines[product_id]
+    for item in items:
+        if item.pk is not None:
+            lines[item.product_id][0] = item.pk
+    entry['dirty'] = False
+
+
+def flush(user_id):
+    with locked(user_id):
+        entry = cache.get(cart_key(user_id))
+        if entry is not None and entry['dirty']:
+            write(entry)
+            cache.set(cart_key(user_id), entry, settings.CART_CACHE_TTL)
+
+
+_pending = set()
+_pending_lock = threading.Lock()
+_timer = None
+
+
+def schedule_flush(user_id):
+    # Changes are coalesced: a cart changed many times within CART_FLUSH_DELAY is written once
+    global _timer
+    with _pending_lock:
+        _pending.add(user_id)
+        if _timer is None:
+            _timer = threading.Timer(settings.CART_FLUSH_DELAY, flush_pending)
+            _timer.daemon = True
+            _timer.start()
+
+
+def flush_pending():
+    global _timer
+    with _pending_lock:
+        user_ids = list(_pending)
+        _pending.clear()
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+    try:
+        for user_id in user_ids:
+            try:
+                flush(user_id)
+            except Exception:
+                logger.exception('Flushing the cart of user %s failed, retrying later', user_id)
+                schedule_flush(user_id)
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connections.close_all()
+
+
+@contextmanager
+def written_back(user_id):
+    # For the views that work on the cart tables: writes the cached cart to the database first and keeps the cart
+    # locked while they run, then drops the entry so the next read loads their changes
+    with locked(user_id):
+        entry = cache.get(cart_key(user_id))
+        if entry is not None and entry['dirty']:
+            write(entry)
+        try:
+            yield
+        finally:
+            cache.delete(cart_key(user_id))
+
+
+def write_back(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with written_back(request.user.pk) if enabled() else nullcontext():
+            return view(request, *args, **kwargs)
+    return wrapper
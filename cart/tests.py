@@ -0,0 +1,366 @@
+import os
+import subprocess
+import sys
+from datetime import timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from threading import Barrier
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from cart import store as cart_store
+from cart.models import Cart, CartItem, Discount
+from inventory import reservations
+from inventory.models import ReservedStock
+from products.models import Category, Product
+
+
+@override_settings(CART_BACKEND='cache', CART_FLUSH_DELAY=3600, STOCK_RESERVATION_TTL=900)
+class CachedCartReservationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cart_store.flush_pending)
+        self.user = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                   password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        category = Category.objects.create(name='Category')
+        self.product = Product.objects.create(name='Product', description='Product', category=category,
+                                              price='10.00', stock_quantity=5)
+
+    def add(self, quantity):
+        return self.client.post('/cart/add/', {'product': self.product.pk, 'quantity': quantity}, format='json')
+
+    def test_lost_entry_releases_its_holds(self):
+        self.assertEqual(self.add(2).status_code, 200)
+        self.assertEqual(ReservedStock.objects.get(product=self.product).quantity, 2)
+
+        # The entry is lost before its line was written back, the hold must not outlive it
+        cache.delete(cart_store.cart_key(self.user.pk))
+        response = self.add(4)
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['item_count'], 4)
+        self.assertEqual(ReservedStock.objects.get(product=self.product).quantity, 4)
+        self.assertEqual(reservations.available(self.product.pk), 1)
+
+    def test_rebuild_keeps_the_holds_of_written_back_lines(self):
+        self.assertEqual(self.add(2).status_code, 200)
+        cart_store.flush(self.user.pk)
+        cache.delete(cart_store.cart_key(self.user.pk))
+
+        self.assertEqual(self.client.get('/cart/').status_code, 200)
+        self.assertEqual(ReservedStock.objects.get(product=self.product).quantity, 2)
+        self.assertEqual(self.add(4).status_code, 400)
+
+
+@override_settings(CART_BACKEND='cache', CART_FLUSH_DELAY=3600, STOCK_RESERVATION_TTL=0)
+class CartStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cart_store.flush_pending)
+        self.user = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                   password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        category = Category.objects.create(name='Category')
+        self.product = Product.objects.create(name='Product', description='Product', category=category,
+                                              price='10.00', stock_quantity=5)
+
+    def add(self, quantity):
+        return self.client.post('/cart/add/', {'product': self.product.pk, 'quantity': quantity}, format='json')
+
+    def lines(self):
+        return list(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_reads_see_the_writes_before_the_flush(self):
+        self.assertEqual(self.add(2).status_code, 200)
+        self.assertEqual(self.add(1).status_code, 200)
+
+        response = self.client.get('/cart/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['product']['id'], item['quantity']) for item in response.data],
+                         [(self.product.pk, 3)])
+        self.assertEqual(self.lines(), [])
+
+    def test_flush_writes_the_lines_and_totals(self):
+        self.assertEqual(self.add(2).status_code, 200)
+
+        cart_store.flush(self.user.pk)
+
+        self.assertEqual(self.lines(), [(self.product.pk, 2)])
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(cart.total_amount, Decimal('20.00'))
+        self.assertFalse(cache.get(cart_store.cart_key(self.user.pk))['dirty'])
+
+    def test_lost_entry_is_rebuilt_from_the_tables(self):
+        self.assertEqual(self.add(2).status_code, 200)
+        cart_store.flush(self.user.pk)
+        cache.delete(cart_store.cart_key(self.user.pk))
+
+        response = self.add(1)
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['item_count'], 3)
+
+    def test_checkout_writes_the_cart_back_first(self):
+        self.assertEqual(self.add(2).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/orders/checkout/', format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 3)
+        self.assertEqual(self.lines(), [])
+        self.assertIsNone(cache.get(cart_store.cart_key(self.user.pk)))
+        self.assertEqual(self.client.get('/cart/').data, [])
+
+
+class CartBackendCheckTests(TestCase):
+    def load_settings(self, **environ):
+        # The check runs when the settings module is imported, so it is imported in a fresh interpreter
+        environ = {**os.environ, 'SECRET_KEY': 'test', 'AUTH_TOKEN_CACHE_TTL': '0', **environ}
+        return subprocess.run([sys.executable, '-c', 'import ecommerce_api.settings'], cwd=settings.BASE_DIR,
+                              env=environ, capture_output=True, text=True)
+
+    def test_cache_cart_needs_an_atomic_add(self):
+        result = self.load_settings(CART_BACKEND='cache', CACHE_BACKEND='file')
+
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('ImproperlyConfigured: CART_BACKEND=cache needs CACHE_BACKEND=locmem or redis', result.stderr)
+
+    def test_cache_cart_with_locmem(self):
+        result = self.load_settings(CART_BACKEND='cache', CACHE_BACKEND='locmem')
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                   password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        category = Category.objects.create(name='Category')
+        self.desk = Product.objects.create(name='Desk', description='Desk', category=category, price='100.00',
+                                           stock_quantity=10)
+        self.lamp = Product.objects.create(name='Lamp', description='Lamp', category=category, price='19.99',
+                                           stock_quantity=10)
+
+    def add(self, product, quantity):
+        response = self.client.post('/cart/add/', {'product': product.pk, 'quantity': quantity}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def totals(self):
+        return Cart.objects.filter(user=self.user).values(
+            'total_amount', 'original_total', 'total_savings', 'item_count').get()
+
+    def test_mutations_keep_the_totals(self):
+        self.add(self.desk, 1)
+        self.add(self.lamp, 2)
+        data = self.add(self.desk, 1)
+
+        self.assertEqual(data['total_amount'], Decimal('239.98'))
+        self.assertEqual(data['item_count'], 4)
+        self.assertEqual(self.totals(), {'total_amount': Decimal('239.98'), 'original_total': Decimal('239.98'),
+                                         'total_savings': 0, 'item_count': 4})
+
+        response = self.client.delete('/cart/clear/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_amount'], 0)
+        self.assertEqual(self.totals(), {'total_amount': 0, 'original_total': 0, 'total_savings': 0, 'item_count': 0})
+
+    def test_checkout_resets_the_totals(self):
+        self.add(self.lamp, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/orders/checkout/').status_code, 201)
+        self.assertEqual(self.totals(), {'total_amount': 0, 'original_total': 0, 'total_savings': 0, 'item_count': 0})
+
+    def test_recompute_repairs_the_totals(self):
+        self.add(self.desk, 2)
+        self.add(self.lamp, 1)
+        expected = self.totals()
+        Cart.objects.update(total_amount=0, original_total=5, total_savings=-5, item_count=99)
+
+        call_command('recompute_cart_totals', '--batch-size', '1', stdout=StringIO())
+
+        self.assertEqual(self.totals(), expected)
+
+
+class ApplyDiscountTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                   password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        self.furniture = Category.objects.create(name='Furniture')
+        self.lighting = Category.objects.create(name='Lighting')
+        self.cart = Cart.objects.create(user=self.user)
+        self.discount = Discount.objects.create(code='DESKS', percentage='15.00', category=self.furniture,
+                                                expiry_date=timezone.now() + timedelta(days=1))
+
+    def add_lines(self, category, count, price='19.99'):
+        products = Product.objects.bulk_create(
+            Product(name=f'{category.name} {i}', description='Product', category=category, price=price,
+                    stock_quantity=10) for i in range(count))
+        CartItem.objects.bulk_create(CartItem(cart=self.cart, product=product, quantity=2,
+                                              discounted_price=product.price) for product in products)
+        Cart.recompute_totals(Cart.objects.filter(pk=self.cart.pk))
+
+    def apply(self, code='DESKS'):
+        return self.client.post('/cart/apply_discount/', {'discount_code': code}, format='json')
+
+    def prices(self, category):
+        return list(CartItem.objects.filter(product__category=category).values_list('discounted_price', flat=True))
+
+    def test_discounts_the_lines_of_its_category_once(self):
+        self.add_lines(self.furniture, 2)
+        self.add_lines(self.lighting, 1)
+
+        response = self.apply()
+
+        self.assertEqual(response.status_code, 200)
+        # 19.99 * 0.85 = 16.9915, rounded by the database
+        self.assertEqual(self.prices(self.furniture), [Decimal('16.99'), Decimal('16.99')])
+        self.assertEqual(self.prices(self.lighting), [Decimal('19.99')])
+        self.assertEqual(response.data['total_amount'], Decimal('107.94'))
+        self.assertEqual(response.data['total_savings'], Decimal('12.00'))
+
+        self.assertEqual(self.apply().status_code, 200)
+        self.assertEqual(self.prices(self.furniture), [Decimal('16.99'), Decimal('16.99')])
+
+    def test_expired_discount_is_refused(self):
+        self.add_lines(self.furniture, 1)
+        Discount.objects.filter(pk=self.discount.pk).update(expiry_date=timezone.now() - timedelta(seconds=1))
+
+        response = self.apply()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Discount code has expired')
+        self.assertEqual(self.prices(self.furniture), [Decimal('19.99')])
+
+    def test_queries_dont_grow_with_the_cart(self):
+        self.add_lines(self.furniture, 1)
+        with CaptureQueriesContext(connection) as small:
+            self.apply()
+        CartItem.objects.update(discount_applied=False)
+        self.add_lines(self.furniture, 30)
+        with self.assertNumQueries(len(small.captured_queries)):
+            self.apply()
+
+
+@override_settings(STOCK_RESERVATION_TTL=0)
+class CartLineTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                   password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        category = Category.objects.create(name='Category')
+        self.product = Product.objects.create(name='Product', description='Product', category=category,
+                                              price='10.00', stock_quantity=10)
+
+    def add(self, quantity):
+        return self.client.post('/cart/add/', {'product': self.product.pk, 'quantity': quantity}, format='json')
+
+    def test_adding_a_product_again_increments_its_line(self):
+        self.assertEqual(self.add(3).status_code, 200)
+        # A discounted line keeps its price when more is added
+        CartItem.objects.update(discounted_price='8.00', discount_applied=True)
+        Cart.recompute_totals()
+        response = self.add(4)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(CartItem.objects.values_list('cart__user', 'quantity', 'discounted_price')),
+                         [(self.user.pk, 7, Decimal('8.00'))])
+        self.assertEqual(response.data['total_amount'], Decimal('56.00'))
+
+    def test_line_never_exceeds_the_stock(self):
+        self.assertEqual(self.add(8).status_code, 200)
+        response = self.add(3)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Cannot add 3 more items. Only 2 items can be added.')
+        self.assertEqual(list(CartItem.objects.values_list('quantity', flat=True)), [8])
+        self.assertEqual(Cart.objects.get(user=self.user).item_count, 8)
+
+    def test_one_line_per_product(self):
+        self.assertEqual(self.add(1).status_code, 200)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=Cart.objects.get(user=self.user), product=self.product,
+                                    discounted_price='10.00')
+
+
+# SQLite's shared in-memory test database fails concurrent writers at once instead of making them wait
+@skipUnless(connection.vendor == 'postgresql', 'Concurrent writes need PostgreSQL')
+class ConcurrentCartAddTests(TransactionTestCase):
+    def test_concurrent_adds_share_one_line(self):
+        user = CustomUser.objects.create_user(username='customer', email='customer@example.com', password='password')
+        category = Category.objects.create(name='Category')
+        product = Product.objects.create(name='Product', description='Product', category=category, price='10.00',
+                                         stock_quantity=100)
+        cart = Cart.objects.create(user=user)
+        barrier = Barrier(8)
+
+        def add(_):
+            try:
+                barrier.wait()
+                return CartItem.add_quantity(cart, product, 2)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            prices = list(executor.map(add, range(8)))
+
+        self.assertEqual(prices, [Decimal('10.00')] * 8)
+        self.assertEqual(list(CartItem.objects.values_list('quantity', flat=True)), [16])
+
+
+class CartLineMigrationTests(TransactionTestCase):
+    before = [('cart', '0002_cart_totals')]
+    after = [('cart', '0003_cartitem_cart')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_lines_move_to_their_cart(self):
+        self.addCleanup(lambda: self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes()))
+        # Only the cart tables go back, the products and users are created with the current models
+        category = Category.objects.create(name='Category')
+        desk, lamp = (Product.objects.create(name=name, description=name, category=category, price='10.00',
+                                             stock_quantity=10) for name in ('Desk', 'Lamp'))
+        users = [CustomUser.objects.create_user(username=name, email=f'{name}@example.com', password='password')
+                 for name in ('first', 'second')]
+        apps = self.migrate(self.before)
+        OldCart = apps.get_model('cart', 'Cart')
+        OldCartItem = apps.get_model('cart', 'CartItem')
+        first, second = (OldCart.objects.create(user_id=user.pk) for user in users)
+        desks = [OldCartItem.objects.create(product_id=desk.pk, quantity=quantity, discounted_price='10.00')
+                 for quantity in (2, 3)]
+        shared = OldCartItem.objects.create(product_id=lamp.pk, quantity=1, discounted_price='9.00')
+        OldCartItem.objects.create(product_id=lamp.pk, quantity=4, discounted_price='10.00')
+        first.items.add(*desks, shared)
+        second.items.add(shared)
+
+        lines = self.migrate(self.after).get_model('cart', 'CartItem').objects
+
+        # Lines repeating a product are merged, a shared line is copied into each cart and a line of no cart dropped
+        self.assertEqual(sorted(lines.values_list('cart_id', 'product_id', 'quantity', 'discounted_price')),
+                         [(first.pk, desk.pk, 5, Decimal('10.00')), (first.pk, lamp.pk, 1, Decimal('9.00')),
+                          (second.pk, lamp.pk, 1, Decimal('9.00'))])
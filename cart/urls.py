@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('', views.get_cart, name='cart-detail'),
@@ -11,3 +11,8 @@ urlpatterns = [
     path('delete_discount/<int:pk>/', views.delete_discount, name='delete-discount'),
     path('discounts/', views.get_discounts, name='get-discounts')
 ]
+
+# Served by the ASGI application in front of the sync views, see ecommerce_api/urls_asgi.py
+async_urlpatterns = [
+    path('', async_views.get_cart, name='cart-detail'),
+] + urlpatterns
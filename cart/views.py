@@ -1,38 +1,53 @@
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, OuterRef, Subquery, prefetch_related_objects
+from django.db.models.functions import Round
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import generics, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
+from accounts.authentication import CachedTokenAuthentication
+from cart import store as cart_store
 from cart.models import Cart, CartItem, Discount
 from cart.serializers import CartSerializer, CartItemSerializer, DiscountSerializer
+from ecommerce_api.idempotency import idempotent
+from inventory import reservations
 from products.models import Product
 
 
 class CartListView(generics.ListAPIView):
-    queryset = Cart.objects.all()
+    queryset = Cart.objects.prefetch_related('items__product__category')
     serializer_class = CartSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAdminUser]
 
 
+def serialize_cart(cart):
+    # Load every line with its product and category at once instead of once per item and per total
+    prefetch_related_objects([cart], 'items__product__category')
+    return CartSerializer(cart).data
+
+
 @api_view(['GET'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 def get_cart(request):
+    if cart_store.enabled():
+        return Response(cart_store.get_items(request.user.pk), status=status.HTTP_200_OK)
     cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
+    cart_items = cart.items.select_related('product__category')
     serializer = CartItemSerializer(cart_items, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
+@idempotent
 def add_to_cart(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
     serializer = CartItemSerializer(data=request.data)
     if serializer.is_valid():
         product_id = request.data.get('product')
@@ -40,78 +55,120 @@ def add_to_cart(request):
         if not product_id:
             return Response({'error': 'Product ID is missing'}, status=status.HTTP_400_BAD_REQUEST)
 
-        product = get_object_or_404(Product, pk=product_id)
-
         quantity = serializer.validated_data['quantity']
 
+        if cart_store.enabled():
+            return add_to_cached_cart(request.user.pk, cart_store.get_product(product_id), quantity)
+
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        product = get_object_or_404(Product, pk=product_id)
+
         if product.stock_quantity < quantity:
             return Response({
                 'error': f'Cannot add {quantity} items to the cart. Only {product.stock_quantity} items are available.'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if the product is already in the cart
-        existing_cart_item = cart.items.filter(product=product).first()
+        with transaction.atomic():
+            if reservations.enabled() and not reservations.reserve(cart.pk, product.pk, quantity):
+                return unavailable_response(product.pk, quantity)
 
-        if existing_cart_item:
-            # Update quantity if item already exists
-            new_quantity = existing_cart_item.quantity + quantity
-            if product.stock_quantity < new_quantity:
+            # Creates the line or adds to its quantity, whether or not a concurrent request just created it
+            discounted_price = CartItem.add_quantity(cart, product, quantity)
+            if discounted_price is None:
+                # Read before marking the rollback, no query can run in the transaction after that
+                in_cart = cart.items.filter(product=product).values_list('quantity', flat=True).first() or 0
+                transaction.set_rollback(True)
                 return Response({
-                    'error': f'Cannot add {quantity} more items. Only {product.stock_quantity - existing_cart_item.quantity} items can be added.'
+                    'error': f'Cannot add {quantity} more items. Only {product.stock_quantity - in_cart} items can be added.'
                 }, status=status.HTTP_400_BAD_REQUEST)
-            existing_cart_item.quantity = new_quantity
-            existing_cart_item.save()
-        else:
-            # Create new cart item and add to cart
-            cart_item = CartItem.objects.create(
-                product=product,
-                quantity=quantity,
-                discounted_price=product.price
-            )
-            cart.items.add(cart_item)
-
-        cart.save()
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data, status=status.HTTP_200_OK)
+            cart.add_to_totals(amount=discounted_price * quantity, original=product.price * quantity, count=quantity)
+
+        return Response(serialize_cart(cart), status=status.HTTP_200_OK)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def unavailable_response(product_id, quantity):
+    # Stock held by the other carts doesn't count as available
+    return Response({
+        'error': f'Cannot add {quantity} items to the cart. Only {reservations.available(product_id)} items are available.'
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+
+def add_to_cached_cart(user_id, product, quantity):
+    # Same checks as add_to_cart against the cached cart and product. With the reservations enabled, as they are by
+    # default, the hold is still written to the database.
+    if product['stock_quantity'] < quantity:
+        return Response({
+            'error': f'Cannot add {quantity} items to the cart. Only {product["stock_quantity"]} items are available.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # The cart stays locked until the hold commits, so a concurrent rebuild of a lost entry can't release it
+    with cart_store.locked(user_id), transaction.atomic():
+        entry = cart_store.load_locked(user_id)
+        if reservations.enabled() and not reservations.reserve(entry['id'], product['id'], quantity):
+            return unavailable_response(product['id'], quantity)
+
+        in_cart = cart_store.quantity_in_cart(entry, product['id'])
+        entry = cart_store.add_quantity(user_id, entry, product, quantity)
+        if entry is None:
+            transaction.set_rollback(True)
+            return Response({
+                'error': f'Cannot add {quantity} more items. Only {product["stock_quantity"] - in_cart} items can be added.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(cart_store.cart_data(user_id, entry), status=status.HTTP_200_OK)
+
+
 @api_view(['DELETE'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
+@idempotent
+@cart_store.write_back
 def clear_cart(request):
     cart = get_object_or_404(Cart, user=request.user)
-    cart.items.all().delete()
+    with transaction.atomic():
+        cart.items.all().delete()
+        cart.reset_totals()
+        reservations.release_cart(cart.pk)
 
-    cart_serializer = CartSerializer(cart)
-    return Response(cart_serializer.data)
+    return Response(serialize_cart(cart))
 
 
 @api_view(['POST'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
+@idempotent
+@cart_store.write_back
 def apply_discount(request):
     cart = get_object_or_404(Cart, user=request.user)
     discount_code = request.data.get('discount_code')
     if discount_code:
         # Apply the discount to the cart
         discount = get_object_or_404(Discount, code=discount_code)
-        for item in cart.items.all():
-            if item.product.category == discount.category and item.discount_applied == False:
-                item.discounted_price = item.product.price - item.product.price * (discount.percentage / 100)
-                item.discount_applied = True
-                item.save()
-
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data)
+        if not discount.is_valid(timezone.now()):
+            return Response({'error': 'Discount code has expired'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Discount every matching line in one UPDATE, the new price is computed by the database
+        product_price = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+        discounted_price = Round(ExpressionWrapper(product_price * (1 - discount.percentage / 100),
+                                                   output_field=DecimalField(max_digits=10, decimal_places=2)), 2)
+        with transaction.atomic():
+            updated = cart.items.filter(product__category=discount.category_id, discount_applied=False).update(
+                discounted_price=discounted_price, discount_applied=True)
+            if updated:
+                Cart.recompute_totals(Cart.objects.filter(pk=cart.pk))
+        if updated:
+            cart.refresh_from_db(fields=['total_amount', 'original_total', 'total_savings', 'item_count'])
+
+        return Response(serialize_cart(cart))
     else:
         return Response({'error': 'Discount code not provided'}, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['POST'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def create_discount(request):
     discount = DiscountSerializer(data=request.data)
@@ -124,7 +181,7 @@ def create_discount(request):
 
 @api_view(['DELETE'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def delete_discount(request, pk):
     discount = Discount.objects.get(pk=pk)
@@ -134,7 +191,7 @@ def delete_discount(request, pk):
 
 @api_view(['GET'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def get_discounts(request):
     discounts = Discount.objects.all()
@@ -0,0 +1,18 @@
+"""
+ASGI config for ecommerce_api project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_api.settings')
+# Serve the hot read endpoints with their async views, see ecommerce_api/urls_asgi.py
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'ecommerce_api.urls_asgi')
+
+application = get_asgi_application()
@@ -0,0 +1,33 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def add_validators(response, etag, timestamp):
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+def conditional_response(request, etag, last_modified, get_response):
+    # Answers If-None-Match / If-Modified-Since with a 304 before get_response() does any work
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = get_response()
+    return add_validators(response, etag, timestamp)
+
+
+async def aconditional_response(request, etag, last_modified, get_response):
+    # Same as conditional_response, for a coroutine function get_response
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = await get_response()
+    return add_validators(response, etag, timestamp)
@@ -0,0 +1,110 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from accounts.models import CustomUser
+from cart.models import Cart, CartItem, Discount
+from inventory import ledger
+from orders.models import Order, OrderItem
+from products.models import Category, Product
+
+PASSWORD = 'benchmark-password'
+ADMIN_EMAIL = 'bench-admin@example.com'
+
+# Base row counts, multiplied by the scale factor
+BASE_SIZES = {
+    'users': 100,
+    'categories': 10,
+    'products': 1000,
+    'carts': 50,
+    'orders': 500,
+}
+
+ADJECTIVES = ['red', 'blue', 'green', 'light', 'heavy', 'compact', 'wireless', 'classic', 'organic', 'vintage',
+              'smart', 'waterproof', 'portable', 'wooden', 'steel', 'cotton']
+NOUNS = ['shoes', 'jacket', 'lamp', 'chair', 'headphones', 'backpack', 'bottle', 'watch', 'keyboard', 'table',
+         'camera', 'blanket', 'mug', 'speaker', 'tent', 'bicycle']
+
+
+def scaled_sizes(scale):
+    return {name: max(1, int(size * scale)) for name, size in BASE_SIZES.items()}
+
+
+def seed(scale=1.0, seed=42, batch_size=1000):
+    # Generates the same dataset for the same scale and seed, using bulk inserts only.
+    # Returns the number of rows created per model.
+    rng = random.Random(seed)
+    sizes = scaled_sizes(scale)
+    password = make_password(PASSWORD)  # hashed once, every generated user shares it
+    now = timezone.now()
+
+    moderators, _ = Group.objects.get_or_create(name='Moderators')
+    admin = CustomUser.objects.create(username='bench-admin', email=ADMIN_EMAIL, password=password, is_staff=True)
+    users = CustomUser.objects.bulk_create(
+        (CustomUser(username=f'bench-user-{i}', email=f'bench-user-{i}@example.com', password=password)
+         for i in range(sizes['users'])), batch_size=batch_size)
+    moderators.user_set.add(*users[:max(1, len(users) // 50)])
+    Token.objects.bulk_create((Token(key=Token.generate_key(), user=user) for user in [admin] + users), batch_size=batch_size)
+
+    categories = Category.objects.bulk_create(
+        Category(name=f'Category {i}', description=f'Generated category {i}') for i in range(sizes['categories']))
+
+    products = Product.objects.bulk_create(
+        (Product(
+            sku=f'BENCH-{i:07d}',
+            name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}',
+            description=' '.join(rng.choice(ADJECTIVES + NOUNS) for _ in range(12)),
+            category=rng.choice(categories),
+            price=Decimal(rng.randint(100, 50000)) / 100,
+            stock_quantity=rng.randint(0, 500),
+        ) for i in range(sizes['products'])), batch_size=batch_size)
+    ledger.open_balances(products)
+
+    Discount.objects.bulk_create(
+        Discount(code=f'BENCH{i}', percentage=Decimal(rng.choice([5, 10, 15, 20])),
+                 expiry_date=now + timedelta(days=365), category=category)
+        for i, category in enumerate(categories))
+
+    # Carts for the first users, a few lines each
+    carts = Cart.objects.bulk_create(Cart(user=user) for user in users[:sizes['carts']])
+    lines = CartItem.objects.bulk_create(
+        (CartItem(cart=cart, product=product, quantity=rng.randint(1, 3), discounted_price=product.price)
+         for cart in carts for product in rng.sample(products, min(len(products), rng.randint(1, 5)))),
+        batch_size=batch_size)
+    Cart.recompute_totals()
+
+    # Historical orders spread over the last year
+    orders, order_items = [], []
+    for _ in range(sizes['orders']):
+        order = Order(user=rng.choice(users), status=rng.choice('PPSDDDC'), total=0)
+        order.historical_date = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+        for product in rng.sample(products, min(len(products), rng.randint(1, 5))):
+            quantity = rng.randint(1, 3)
+            order_items.append((order, OrderItem(product=product, quantity=quantity, unit_price=product.price,
+                                                 total_price=product.price * quantity)))
+            order.total += product.price * quantity
+        orders.append(order)
+    Order.objects.bulk_create(orders, batch_size=batch_size)
+    # date is auto_now_add, so bulk_create stamped it with the current time
+    for order in orders:
+        order.date = order.historical_date
+    Order.objects.bulk_update(orders, ['date'], batch_size=batch_size)
+    for order, item in order_items:
+        item.order = order
+    OrderItem.objects.bulk_create((item for order, item in order_items), batch_size=batch_size)
+
+    return {
+        'users': len(users) + 1,
+        'categories': len(categories),
+        'products': len(products),
+        'discounts': len(categories),
+        'carts': len(carts),
+        'cart_items': len(lines),
+        'orders': len(orders),
+        'order_items': len(order_items),
+    }
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from ecommerce_api.models import IdempotencyKey
+
+
+def idempotency_key(request, key):
+    # Keys are scoped to the user and the endpoint, one client can't replay another's responses
+    return hashlib.sha256(f'{request.user.pk}:{request.method}:{request.path}:{key}'.encode()).hexdigest()
+
+
+def fingerprint(request):
+    return hashlib.sha256(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def replay(entry):
+    response = Response(entry.data, status=entry.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def claim(key, request_fingerprint):
+    # Inserts the key, in its own transaction so the retries see it while the view runs. Returns None if another
+    # request holds it; the unique key makes the check and the insert a single atomic step, on any database.
+    expires_at = timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_IN_FLIGHT_TIMEOUT)
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=key, fingerprint=request_fingerprint, expires_at=expires_at)
+    except IntegrityError:
+        return None
+
+
+def purge_expired(batch_size=1000):
+    # Deletes the expired keys in batches, returns how many
+    purged = 0
+    while True:
+        batch = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).order_by('expires_at')
+                     .values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=batch, expires_at__lte=timezone.now()).delete()[0]
+
+
+def idempotent(view):
+    # Honours the Idempotency-Key header: the first response to a key is stored for IDEMPOTENCY_KEY_TTL seconds and
+    # returned again for any retry with the same key and body, without running the view. A retry arriving while the
+    # first request is still running waits for its response instead of running the view a second time.
+    # Server errors are not stored, so the request can be retried.
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > 255:
+            return Response({'error': 'Idempotency-Key must be 1 to 255 characters long'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        key = idempotency_key(request, key)
+        request_fingerprint = fingerprint(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            claimed = claim(key, request_fingerprint)
+            if claimed is not None:
+                break
+            entry = IdempotencyKey.objects.filter(key=key).first()
+            if entry is None:
+                # The first request failed, run this one instead
+                continue
+            if entry.expires_at <= timezone.now():
+                # Expired, or its request died while running: free it unless it has just been claimed again
+                IdempotencyKey.objects.filter(pk=entry.pk, expires_at=entry.expires_at).delete()
+                continue
+            if entry.fingerprint != request_fingerprint:
+                return Response({'error': 'Idempotency-Key was already used with a different request'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if entry.status_code is not None:
+                return replay(entry)
+            if time.monotonic() > deadline:
+                return Response({'error': 'A request with this Idempotency-Key is still being processed'},
+                                status=status.HTTP_409_CONFLICT)
+            time.sleep(0.05)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            IdempotencyKey.objects.filter(pk=claimed.pk).delete()
+            raise
+        # By pk: if this request outlived IDEMPOTENCY_IN_FLIGHT_TIMEOUT, a retry may hold the key now
+        if response.status_code >= 500 or not isinstance(response, Response):
+            IdempotencyKey.objects.filter(pk=claimed.pk).delete()
+        else:
+            IdempotencyKey.objects.filter(pk=claimed.pk).update(
+                status_code=response.status_code, data=response.data,
+                expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL))
+        return response
+
+    return wrapper
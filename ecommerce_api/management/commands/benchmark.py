@@ -0,0 +1,100 @@
+import asyncio
+import json
+import platform
+import random
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from ecommerce_api import datagen
+from ecommerce_api.workload import Workload
+
+# The URLconf each deployment serves, see ecommerce_api/wsgi.py and ecommerce_api/asgi.py
+URLCONFS = {
+    'wsgi': 'ecommerce_api.urls',
+    'asgi': 'ecommerce_api.urls_asgi',
+}
+
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway test database with the synthetic dataset, replays a mixed workload through the '
+            'WSGI and/or ASGI request handlers and reports latency percentiles, throughput and query counts per '
+            'endpoint as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help=f'Multiplies the base dataset sizes: {datagen.BASE_SIZES}.')
+        parser.add_argument('--seed', type=int, default=42, help='Seed of both the dataset and the workload.')
+        parser.add_argument('--requests', type=int, default=2000, help='Number of measured requests.')
+        parser.add_argument('--warmup', type=int, default=200, help='Number of requests made before measuring.')
+        parser.add_argument('--server', nargs='+', choices=list(URLCONFS), default=list(URLCONFS),
+                            help='Request handlers to benchmark, each one against a freshly seeded database.')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Concurrent virtual users for asgi. A sync worker serves one request at a time, '
+                                 'so wsgi always replays them sequentially.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        report = {
+            'parameters': {
+                'scale': options['scale'],
+                'seed': options['seed'],
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+                'concurrency': options['concurrency'],
+                'dataset': datagen.scaled_sizes(options['scale']),
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+            },
+            'servers': {},
+        }
+
+        setup_test_environment()
+        try:
+            for server in options['server']:
+                report['servers'][server] = self.run_server(server, options)
+        finally:
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+            self.stderr.write(f'Report written to {options["output"]}')
+        else:
+            self.stdout.write(output, ending='')
+
+    def run_server(self, server, options):
+        # Only the primary is turned into a test database, the replicas would still be the real ones
+        production_like = override_settings(DEBUG=False, ROOT_URLCONF=URLCONFS[server], REPLICA_DATABASES=[])
+        production_like.enable()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            datagen.seed(options['scale'], options['seed'])
+            cache.clear()
+            rng = random.Random(options['seed'])
+
+            if server == 'wsgi':
+                Workload(rng).run(options['warmup'])
+                workload = Workload(rng)
+                start = time.perf_counter()
+                workload.run(options['requests'])
+            else:
+                asyncio.run(Workload(rng).arun(options['warmup'], options['concurrency']))
+                workload = Workload(rng)
+                start = time.perf_counter()
+                asyncio.run(workload.arun(options['requests'], options['concurrency']))
+            return workload.results.report(time.perf_counter() - start)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            production_like.disable()
@@ -0,0 +1,128 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from rest_framework.authtoken.models import Token
+
+from cart.models import Cart
+from ecommerce_api import datagen
+from inventory.models import Reservation, StockMovement
+from orders.export import filter_orders
+from orders.models import Order, OrderItem
+from products.models import Product
+from tasks.models import Task
+
+PAGE = 51  # page size + 1, as the cursor paginators fetch it
+
+
+# The main queries of the API, each built from the seeded Dataset. The ordered ones must also read their rows in
+# index order: they are paginated, so sorting the matches would mean reading all of them for every page.
+QUERIES = {
+    'own orders page': (True, lambda d: Order.objects.filter(user=d.user).order_by('-date', '-id')[:PAGE]),
+    'own orders next page': (True, lambda d: Order.objects.filter(user=d.user, date__lt=d.order.date)
+                             .order_by('-date', '-id')[:PAGE]),
+    'own orders ETag': (False, lambda d: Order.objects.filter(user=d.user).values('updated_at')),
+    'all orders next page': (True, lambda d: Order.objects.filter(date__lt=d.order.date)
+                             .order_by('-date', '-id')[:PAGE]),
+    'order export by status and dates': (False, lambda d: filter_orders('D', d.since, d.until)),
+    'order export by dates': (False, lambda d: filter_orders(None, d.since, d.until)),
+    'order details': (False, lambda d: OrderItem.objects.filter(order=d.order).select_related('product')),
+    'order lines of a product': (False, lambda d: OrderItem.objects.filter(product=d.product)),
+    'catalog next page': (True, lambda d: Product.objects.select_related('category').filter(pk__gt=d.product.pk)
+                          .order_by('pk')[:PAGE]),
+    'catalog by category and price': (False, lambda d: Product.objects.filter(
+        category=d.product.category, price__gte=1, price__lte=100)),
+    'cart lines': (False, lambda d: d.cart.items.select_related('product__category')),
+    'expired reservations': (True, lambda d: Reservation.objects.filter(expires_at__lte=d.until)
+                             .order_by('expires_at')[:1000]),
+    'stock movements to compact': (True, lambda d: StockMovement.objects.filter(created_at__lt=d.until)
+                                   .order_by('created_at')[:1000]),
+    'due tasks': (True, lambda d: Task.objects.filter(failed=False, run_at__lte=d.until).order_by('run_at')[:100]),
+    'token': (False, lambda d: Token.objects.select_related('user').filter(key=d.token)),
+}
+
+
+class Dataset:
+    def __init__(self, scale):
+        datagen.seed(scale)
+        self.user = Order.objects.values('user').annotate(orders=Count('id')).order_by('-orders')[0]['user']
+        self.order = Order.objects.filter(user=self.user).order_by('-date')[1]
+        self.product = Product.objects.order_by('pk')[1]
+        self.cart = Cart.objects.first()
+        self.token = Token.objects.first().key
+        self.until = self.order.date
+        self.since = self.until - timedelta(days=30)
+
+
+def sqlite_problems(plan, ordered):
+    problems = []
+    for line in plan.splitlines():
+        table = re.search(r'\bSCAN (\w+)$', line)
+        if table:
+            problems.append(f'full scan of {table.group(1)}')
+        if ordered and 'USE TEMP B-TREE FOR ORDER BY' in line:
+            problems.append('sort instead of index order')
+    return problems
+
+
+def postgresql_problems(plan, ordered):
+    problems = []
+    for line in plan.splitlines():
+        table = re.search(r'Seq Scan on (\w+)', line)
+        if table:
+            problems.append(f'full scan of {table.group(1)}')
+        if ordered and re.match(r'\s*(->\s*)?(Incremental )?Sort\b', line):
+            problems.append('sort instead of index order')
+    return problems
+
+
+def explain_queries(dataset):
+    # Yields (name, plan, problems) for each of the QUERIES, run against the current database
+    find_problems = sqlite_problems if connection.vendor == 'sqlite' else postgresql_problems
+    for name, (ordered, build) in QUERIES.items():
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # The planner prefers sequential scans on small tables, only fall back to them without an index
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                    cursor.execute('SET LOCAL enable_sort = off')
+            plan = build(dataset).explain()
+        yield name, plan, find_problems(plan, ordered)
+
+
+class Command(BaseCommand):
+    help = ('Seeds a throwaway test database and runs EXPLAIN on the main queries of the API, failing if one of '
+            'them falls back to a full table scan, or to a sort for the paginated ones. SQLite and PostgreSQL only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=0.2, help='Dataset scale, see the seed_data command.')
+        parser.add_argument('--show-plans', action='store_true')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'Query plans of {connection.vendor} are not supported.')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            failures = self.check_plans(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if failures:
+            raise CommandError(f'{len(failures)} query plan(s) without a usable index:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Every query uses an index.'))
+
+    def check_plans(self, options):
+        failures = []
+        for name, plan, problems in explain_queries(Dataset(options['scale'])):
+            line = f'{name:35} {", ".join(problems) or "ok"}'
+            if problems:
+                failures.append(line)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+            if options['show_plans'] or problems:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+        return failures
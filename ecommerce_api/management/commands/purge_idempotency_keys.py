@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce_api.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Deletes the expired Idempotency-Key entries, in batches. Runs once, or forever with --interval.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of keys deleted by each statement.')
+        parser.add_argument('--interval', type=float,
+                            help='Seconds to wait between sweeps; without it the command sweeps once and exits.')
+
+    def handle(self, *args, **options):
+        while True:
+            purged = purge_expired(options['batch_size'])
+            self.stdout.write(f'Purged {purged} expired idempotency keys.')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import CustomUser
+from ecommerce_api import datagen
+
+
+class Command(BaseCommand):
+    help = 'Seeds the configured database with a deterministic synthetic dataset, for benchmarks and manual testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help=f'Multiplies the base sizes: {datagen.BASE_SIZES}.')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if CustomUser.objects.filter(email=datagen.ADMIN_EMAIL).exists():
+            raise CommandError('The database already contains the generated dataset.')
+        with transaction.atomic():
+            created = datagen.seed(options['scale'], options['seed'])
+        self.stdout.write(self.style.SUCCESS(
+            'Created ' + ', '.join(f'{count} {name}' for name, count in created.items()) +
+            f'. Every generated user logs in with the password "{datagen.PASSWORD}".'))
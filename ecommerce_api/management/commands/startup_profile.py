@@ -0,0 +1,114 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter, so the timings include every import the server process pays for.
+# Prints the timings of one cold start as JSON.
+PROBE = r'''
+import time
+start = time.perf_counter()
+
+import asyncio, io, json, os, sys
+handler, path, warmup = sys.argv[1], sys.argv[2], sys.argv[3] == 'True'
+
+
+def wsgi_request(application):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '8000', 'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http'}
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    response.close()
+    return int(statuses[0].split()[0])
+
+
+async def asgi_request(application):
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+             'headers': [(b'host', b'localhost')], 'server': ('localhost', 8000), 'client': ('127.0.0.1', 0)}
+    statuses = []
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.Event().wait()  # no disconnect, the handler cancels this once it has responded
+        sent = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await application(scope, receive, send)
+    return statuses[0]
+
+
+if handler == 'wsgi':
+    from ecommerce_api.wsgi import application
+    request = lambda: wsgi_request(application)
+else:
+    from ecommerce_api.asgi import application
+    request = lambda: asyncio.run(asgi_request(application))
+imported = time.perf_counter()
+
+if warmup:
+    from ecommerce_api.startup import warmup as run_warmup
+    run_warmup()
+warmed_up = time.perf_counter()
+
+status = request()
+first = time.perf_counter()
+request()
+second = time.perf_counter()
+
+print(json.dumps({
+    'status': status,
+    'import_ms': (imported - start) * 1000,
+    'warmup_ms': (warmed_up - imported) * 1000,
+    'first_request_ms': (first - warmed_up) * 1000,
+    'second_request_ms': (second - first) * 1000,
+    'time_to_first_request_ms': (first - start) * 1000,
+}))
+'''
+
+TIMINGS = ['import_ms', 'warmup_ms', 'first_request_ms', 'second_request_ms', 'time_to_first_request_ms']
+
+
+class Command(BaseCommand):
+    help = ('Starts fresh interpreters that import the WSGI or ASGI application, optionally warm it up and serve '
+            'one request, and reports the median import time and time to first request.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handler', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--path', default='/store/categories/', help='Path of the first request.')
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--no-warmup', action='store_true',
+                            help='Skip ecommerce_api.startup.warmup(), as with STARTUP_WARMUP=False.')
+        parser.add_argument('--json', action='store_true', help='Print the medians as JSON.')
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'ecommerce_api.settings')}
+        runs = []
+        for _ in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-c', PROBE, options['handler'], options['path'], str(not options['no_warmup'])],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise CommandError(f'The startup probe failed:\n{result.stderr}')
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+        medians = {timing: round(statistics.median(run[timing] for run in runs), 1) for timing in TIMINGS}
+        medians['status'] = runs[-1]['status']
+        if options['json']:
+            self.stdout.write(json.dumps(medians, indent=2, sort_keys=True))
+            return
+        self.stdout.write(f'{options["handler"].upper()} GET {options["path"]} -> {medians["status"]}, '
+                          f'median of {len(runs)} cold starts:')
+        for timing in TIMINGS:
+            self.stdout.write(f'  {timing[:-3].replace("_", " "):26} {medians[timing]:8.1f} ms')
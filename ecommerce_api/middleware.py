@@ -0,0 +1,142 @@
+import hashlib
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from ecommerce_api import replicas
+
+# Collapses "IN (%s, %s, %s)" style placeholder lists so batches of different sizes share a fingerprint
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+
+
+def fingerprint(sql):
+    normalized = _PLACEHOLDER_LIST.sub('(%s, ...)', sql)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:10]
+
+
+# Records every SQL statement executed on any database connection while it is active.
+# Parameters are kept out of the fingerprint, so the same statement run with different values
+# (the usual N+1 symptom) counts as a duplicate.
+# From async code, use it with "async with": the queries of async views run in the sync thread, on
+# connections of their own.
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self._stack = None
+        self._wrapped = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def wrap_connections(self):
+        for connection in connections.all():
+            if id(connection) not in self._wrapped:
+                self._wrapped.add(id(connection))
+                self._stack.enter_context(connection.execute_wrapper(self))
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        self.wrap_connections()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._wrapped.clear()
+
+    async def __aenter__(self):
+        self.__enter__()
+        await sync_to_async(self.wrap_connections)()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+    @property
+    def duplicates(self):
+        return {key: count for key, count in self.fingerprints.most_common() if count > 1}
+
+
+# Adds the number of queries, the time spent in the database and the fingerprints of repeated
+# queries to every response. Enabled with the QUERY_INSTRUMENTATION setting.
+# Async capable, so it doesn't push the async views of the ASGI application back into a thread.
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        return self.add_headers(response, recorder)
+
+    async def __acall__(self, request):
+        async with QueryRecorder() as recorder:
+            response = await self.get_response(request)
+        return self.add_headers(response, recorder)
+
+    @staticmethod
+    def add_headers(response, recorder):
+        duplicates = recorder.duplicates
+        response['X-DB-Query-Count'] = recorder.count
+        response['X-DB-Time-Ms'] = f'{recorder.duration * 1000:.2f}'
+        response['X-DB-Duplicate-Queries'] = sum(duplicates.values()) - len(duplicates)
+        if duplicates:
+            response['X-DB-Duplicate-Fingerprints'] = ', '.join(
+                f'{key}:{count}' for key, count in list(duplicates.items())[:5])
+        return response
+
+
+# Sends the reads of a user who has just made a successful write request back to the primary for
+# REPLICA_STICKY_SECONDS, see ecommerce_api/replicas.py. Enabled when read replicas are configured.
+class ReplicaStickinessMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.wrote(request, response):
+            replicas.stick(replicas.user_scope(request.user))
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.wrote(request, response):
+            await replicas.astick(replicas.user_scope(request.user))
+        return response
+
+    @staticmethod
+    def wrote(request, response):
+        # The user is set on the request by the authentication of the view
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and \
+            getattr(request, 'user', None) is not None
@@ -0,0 +1,25 @@
+from django.db import models
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# The first request made with an Idempotency-Key (ecommerce_api/idempotency.py): the unique key lets only one request
+# claim it, and once it has run its response is kept for the retries
+class IdempotencyKey(models.Model):
+    # sha256 of the user, endpoint and client key
+    key = models.CharField(max_length=64, unique=True)
+    # sha256 of the request body
+    fingerprint = models.CharField(max_length=64)
+    # None while the first request is running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    # Encoded like the API responses, so a replay renders the same body
+    data = models.JSONField(null=True, encoder=JSONEncoder)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Expired keys, oldest first (purge_expired)
+            models.Index(fields=['expires_at'], name='ecommerce_api_idem_exp_idx'),
+        ]
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    # Keyset pagination on the primary key: every page is a range scan on the pk index,
+    # however deep the client goes. PAGE_SIZE comes from the REST_FRAMEWORK settings.
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class DateCursorPagination(IdCursorPagination):
+    # Newest first, ties on the same timestamp are broken by id
+    ordering = ('-date', '-id')
@@ -0,0 +1,164 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import Group
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from cart.models import Cart, CartItem, Discount
+from inventory.models import Reservation, ReservedStock
+from orders.models import Order, OrderItem
+from products.models import Category, Product
+
+# The query budgets of the API endpoints, checked by ecommerce_api/tests.py: each endpoint is called with a dataset
+# seeded at several sizes, and must run exactly the number of queries pinned here.
+
+PASSWORD = 'budget-password'
+
+
+# Number of queries of one request: a fixed part, plus an allowance per row of the dataset for the endpoints
+# whose work is still proportional to the size of a cart or order.
+class Budget:
+    def __init__(self, queries, per_row=0):
+        self.queries = queries
+        self.per_row = per_row
+
+    def expected(self, size):
+        return self.queries + self.per_row * size
+
+
+# Every route of ecommerce_api/urls.py and ecommerce_api/urls_asgi.py must appear here, see get_routes()
+SCENARIOS = {
+    'auth/register/': (Budget(7), lambda d: (d.anonymous, 'post', {
+        'username': 'newcomer', 'email': 'newcomer@example.com', 'password': PASSWORD,
+        'password_confirm': PASSWORD})),
+    'auth/login/': (Budget(2), lambda d: (d.anonymous, 'post', {'email': d.customer.email, 'password': PASSWORD})),
+    'auth/logout/': (Budget(3), lambda d: (d.customer_client, 'post', None)),
+    'auth/profile/': (Budget(2), lambda d: (d.customer_client, 'get', None)),
+    'auth/update/': (Budget(6), lambda d: (d.customer_client, 'put', {
+        'username': 'renamed', 'email': 'renamed@example.com'})),
+    'auth/ban/': (Budget(5), lambda d: (d.moderator_client, 'put', {'username': d.customer.username})),
+    'auth/unban/': (Budget(5), lambda d: (d.moderator_client, 'put', {'username': d.customer.username})),
+    'auth/users/': (Budget(3), lambda d: (d.moderator_client, 'get', None)),
+    'auth/users/<int:pk>/': (Budget(3), lambda d: (d.moderator_client, 'get', None, d.customer.pk)),
+
+    'store/categories/': (Budget(3), lambda d: (d.anonymous, 'get', None)),
+    'store/categories/create/': (Budget(3), lambda d: (d.admin_client, 'post', {'name': 'New category'})),
+    'store/categories/update/<int:pk>/': (Budget(4), lambda d: (d.admin_client, 'put', {
+        'name': 'Renamed category'}, d.category.pk)),
+    'store/categories/delete/<int:pk>/': (Budget(13), lambda d: (d.admin_client, 'delete', None, d.category.pk)),
+    'store/products/': (Budget(4), lambda d: (d.anonymous, 'get', None)),
+    'store/products/search/': (Budget(1), lambda d: (d.anonymous, 'get', {'q': 'product', 'in_stock': 'true'})),
+    'store/products/create/': (Budget(6), lambda d: (d.admin_client, 'post', {
+        'name': 'New product', 'description': 'New', 'category': d.category.pk, 'price': '9.99',
+        'stock_quantity': 10})),
+    'store/products/import/': (Budget(9), lambda d: (d.admin_client, 'post', {'file': d.import_file()})),
+    'store/products/export/': (Budget(2), lambda d: (d.admin_client, 'get', {'file_format': 'jsonl'})),
+    'store/products/update/<int:pk>/': (Budget(8), lambda d: (d.admin_client, 'put', {
+        'name': 'Renamed product', 'description': 'Renamed', 'category': d.category.pk, 'price': '19.99',
+        'stock_quantity': 10}, d.product.pk)),
+    'store/products/delete/<int:pk>/': (Budget(10), lambda d: (d.admin_client, 'delete', None, d.product.pk)),
+
+    'cart/': (Budget(4), lambda d: (d.customer_client, 'get', None)),
+    'cart/add/': (Budget(13), lambda d: (d.customer_client, 'post', {'product': d.product.pk, 'quantity': 1})),
+    'cart/clear/': (Budget(11), lambda d: (d.customer_client, 'delete', None)),
+    'cart/create_discount/': (Budget(4), lambda d: (d.admin_client, 'post', {
+        'code': 'NEWCODE', 'percentage': '5.00', 'expiry_date': d.expiry.isoformat(),
+        'category': d.category.pk})),
+    'cart/apply_discount/': (Budget(12), lambda d: (d.customer_client, 'post', {
+        'discount_code': d.discount.code})),
+    'cart/delete_discount/<int:pk>/': (Budget(3), lambda d: (d.admin_client, 'delete', None, d.discount.pk)),
+    'cart/discounts/': (Budget(2), lambda d: (d.admin_client, 'get', None)),
+
+    'orders/all/': (Budget(2), lambda d: (d.admin_client, 'get', None)),
+    'orders/export/': (Budget(3), lambda d: (d.admin_client, 'get', {'include_items': 'true'})),
+    'orders/': (Budget(4), lambda d: (d.customer_client, 'get', None)),
+    'orders/<int:pk>/': (Budget(4), lambda d: (d.customer_client, 'get', None, d.order.pk)),
+    'orders/checkout/': (Budget(16), lambda d: (d.customer_client, 'post', None)),
+    'orders/update/<int:pk>/': (Budget(9), lambda d: (d.customer_client, 'put', {
+        'status': 'C'}, d.order.pk)),
+    'orders/bulk_update/': (Budget(9), lambda d: (d.admin_client, 'post', {
+        'orders': [order.pk for order in d.orders], 'status': 'C'})),
+    'orders/delete/<int:pk>/': (Budget(9), lambda d: (d.admin_client, 'delete', None, d.order.pk)),
+    'orders/stats/': (Budget(2), lambda d: (d.admin_client, 'get', None)),
+}
+
+
+# Seeds a dataset where the carts, orders and listings all grow with size
+class Dataset:
+    def __init__(self, size):
+        self.size = size
+        self.anonymous = APIClient()
+        self.admin, self.admin_client = self.create_user('admin', is_staff=True)
+        self.moderator, self.moderator_client = self.create_user('moderator')
+        self.moderator.groups.add(Group.objects.get_or_create(name='Moderators')[0])
+        self.customer, self.customer_client = self.create_user('customer')
+        CustomUser.objects.bulk_create(
+            CustomUser(username=f'user{i}', email=f'user{i}@example.com') for i in range(size))
+
+        categories = [Category.objects.create(name=f'Category {i}') for i in range(2)]
+        self.category = categories[0]
+        products = Product.objects.bulk_create(
+            Product(sku=f'SKU{i}', name=f'Product {i}', description='Product', category=categories[i % 2],
+                    price='10.00', stock_quantity=1000)
+            for i in range(size))
+        self.product = products[0]
+
+        self.expiry = timezone.now() + timedelta(days=30)
+        self.discount = Discount.objects.create(code='BUDGET', percentage='10.00', expiry_date=self.expiry,
+                                                category=self.category)
+
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=1, discounted_price=product.price) for product in products)
+        Cart.recompute_totals(Cart.objects.filter(pk=cart.pk))
+        # The lines hold their stock, as if they had been added through the API
+        Reservation.objects.bulk_create(
+            Reservation(cart=cart, product=product, quantity=1, expires_at=self.expiry) for product in products)
+        ReservedStock.objects.bulk_create(ReservedStock(product=product, quantity=1) for product in products)
+
+        self.orders = Order.objects.bulk_create(Order(user=self.customer, total='10.00') for _ in range(size))
+        self.order = self.orders[0]
+        OrderItem.objects.bulk_create(
+            OrderItem(order=self.order, product=product, quantity=1, unit_price=product.price,
+                      total_price=product.price)
+            for product in products)
+
+    def import_file(self):
+        # Updates every seeded product and creates as many new ones
+        lines = ['sku,name,description,category,price,stock_quantity']
+        lines += [f'SKU{i},Product {i},Imported,{self.category.pk},12.50,5' for i in range(2 * self.size)]
+        return SimpleUploadedFile('products.csv', '\n'.join(lines).encode())
+
+    @staticmethod
+    def create_user(name, is_staff=False):
+        user = CustomUser.objects.create_user(username=name, email=f'{name}@example.com', password=PASSWORD,
+                                              is_staff=is_staff)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        return user, client
+
+
+def get_routes(patterns=None, prefix=''):
+    routes = []
+    for pattern in patterns if patterns is not None else get_resolver().url_patterns:
+        if isinstance(pattern, URLResolver):
+            routes += get_routes(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern):
+            routes.append(prefix + str(pattern.pattern))
+    return routes
+
+
+def request(route, dataset):
+    # Sends the route's scenario request, reading a streamed response to the end so its queries are run too
+    client, method, data, *pk = SCENARIOS[route][1](dataset)
+    path = '/' + route.replace('<int:pk>', str(pk[0]) if pk else '')
+    multipart = data and any(isinstance(value, File) for value in data.values())
+    response = getattr(client, method)(path, data, format='multipart' if multipart else 'json')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
@@ -0,0 +1,100 @@
+import random
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# Read replicas: the read-only views decorated with @replica_reads run their queries on one of the
+# REPLICA_DATABASES, everything else, writes included, on the primary. A user who has just written, or a scope whose
+# data has just changed (e.g. the catalog, whose listings are cached), reads from the primary again for
+# REPLICA_STICKY_SECONDS, so a replica that hasn't caught up yet is never read from in the meantime.
+
+# Database alias the reads of the current view go to, None for the primary
+_read_alias = ContextVar('replica_read_alias', default=None)
+
+
+def sticky_key(scope):
+    return f'replica:sticky:{scope}'
+
+
+def user_scope(user):
+    return f'user:{user.pk}' if user is not None and user.is_authenticated else None
+
+
+def stick(scope):
+    # The reads of scope go to the primary for the next REPLICA_STICKY_SECONDS
+    if settings.REPLICA_DATABASES and scope:
+        cache.set(sticky_key(scope), True, settings.REPLICA_STICKY_SECONDS)
+
+
+async def astick(scope):
+    if settings.REPLICA_DATABASES and scope:
+        await cache.aset(sticky_key(scope), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def sticky_keys(user, scopes):
+    return [sticky_key(scope) for scope in (user_scope(user), *scopes) if scope]
+
+
+def pick(sticky):
+    return None if sticky else random.choice(settings.REPLICA_DATABASES)
+
+
+@contextmanager
+def replica(user, *scopes):
+    alias = pick(cache.get_many(sticky_keys(user, scopes))) if settings.REPLICA_DATABASES else None
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@asynccontextmanager
+async def areplica(user, *scopes):
+    alias = pick(await cache.aget_many(sticky_keys(user, scopes))) if settings.REPLICA_DATABASES else None
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_reads(*scopes):
+    # For read-only views, sync or async: their writes would still go to the primary, but their reads might not see
+    # them. The request user is always one of the scopes.
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                async with areplica(getattr(request, 'user', None), *scopes):
+                    return await view(request, *args, **kwargs)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                with replica(getattr(request, 'user', None), *scopes):
+                    return view(request, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class ReplicaRouter:
+    # Enabled by settings.py when REPLICA_DATABASE_URLS is set. Outside a @replica_reads view every read goes to
+    # the primary, even for an object loaded from a replica.
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -1,16 +1,22 @@
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 import secrets
 
-with open("secret.txt", "w") as file:
-    file.write(secrets.token_urlsafe().strip())
-
-with open("secret.txt") as file:
-    SECRET_KEY = file.read()
+# Read, never written, at import: every worker of a deployment must sign with the same key. entrypoint.sh creates
+# the file once per container when SECRET_KEY isn't set, a process without either gets a throwaway key.
+SECRET_KEY_FILE = Path(os.environ.get('SECRET_KEY_FILE', BASE_DIR / 'secret.txt'))
+if os.environ.get('SECRET_KEY'):
+    SECRET_KEY = os.environ['SECRET_KEY']
+elif SECRET_KEY_FILE.exists():
+    SECRET_KEY = SECRET_KEY_FILE.read_text().strip()
+else:
+    SECRET_KEY = secrets.token_urlsafe(50)
 
 DEBUG = False
 
@@ -24,10 +30,13 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
     'corsheaders',
+    'ecommerce_api',
     'accounts',
     'products',
     'cart',
     'orders',
+    'inventory',
+    'tasks',
 ]
 
 MIDDLEWARE = [
@@ -35,20 +44,110 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ecommerce_api.middleware.QueryInstrumentationMiddleware',
+    'ecommerce_api.middleware.ReplicaStickinessMiddleware',
 ]
 
+# Per-request query count, DB time and duplicate query fingerprints in the X-DB-* response headers
+QUERY_INSTRUMENTATION = os.environ.get('QUERY_INSTRUMENTATION', 'False') == 'True'
+CORS_EXPOSE_HEADERS = ['X-DB-Query-Count', 'X-DB-Time-Ms', 'X-DB-Duplicate-Queries', 'X-DB-Duplicate-Fingerprints']
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'ecommerce_api.pagination.IdCursorPagination',
+    'PAGE_SIZE': int(os.environ.get('API_PAGE_SIZE', 50)),
 }
 
 AUTH_USER_MODEL = "accounts.CustomUser"
 
-ROOT_URLCONF = 'ecommerce_api.urls'
+# Cache backend: 'locmem' (per process), 'file' (shared by all the workers of a host, at CACHE_LOCATION) or 'redis'
+# (shared by every host, CACHE_LOCATION is then a redis:// URL)
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+# Backends whose add() is atomic, which the locks of the cache cart store rely on. The file backend checks and writes
+# in two steps, so two workers can both take the same lock.
+ATOMIC_ADD_CACHE_BACKENDS = ('locmem', 'redis')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION',
+                                   'redis://127.0.0.1:6379' if CACHE_BACKEND == 'redis' else '/tmp/ecommerce_api_cache'),
+    }
+}
+
+# Backends shared by all the workers of a host (file) or by every host (redis)
+SHARED_CACHE_BACKENDS = ('file', 'redis')
+
+# Seconds a resolved auth token stays cached, logout, ban, unban and profile updates invalidate it. The invalidation
+# only reaches the other workers through a shared cache, so the tokens are not cached with 'locmem'.
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL',
+                                          300 if CACHE_BACKEND in SHARED_CACHE_BACKENDS else 0))
+if AUTH_TOKEN_CACHE_TTL > 0 and CACHE_BACKEND not in SHARED_CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"AUTH_TOKEN_CACHE_TTL needs CACHE_BACKEND={' or '.join(SHARED_CACHE_BACKENDS)}, "
+                               f"a logout or ban would not reach the tokens cached by the other '{CACHE_BACKEND}' "
+                               f"processes")
+
+# Seconds the product and category listings stay cached, they are also invalidated on every catalog change
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 300))
+# Seconds the stock of a product stays cached for the listings and the cart store. A stock change drops it, the TTL
+# bounds how long a read racing that change can keep serving the stock of before it.
+STOCK_CACHE_TTL = int(os.environ.get('STOCK_CACHE_TTL', 30))
+
+# Cart backend: 'db' (the cart views work on the cart tables) or 'cache' (the cart lives in the cache and is written
+# back to the tables CART_FLUSH_DELAY seconds after a change and before checkout). 'cache' needs a cache backend with
+# an atomic add(), and shared by all the workers with more than one: 'redis', or 'locmem' with a single process.
+CART_BACKEND = os.environ.get('CART_BACKEND', 'db')
+if CART_BACKEND == 'cache' and CACHE_BACKEND not in ATOMIC_ADD_CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"CART_BACKEND=cache needs CACHE_BACKEND={' or '.join(ATOMIC_ADD_CACHE_BACKENDS)}, "
+                               f"the '{CACHE_BACKEND}' backend has no atomic add() for the cart locks")
+CART_FLUSH_DELAY = float(os.environ.get('CART_FLUSH_DELAY', 5))
+CART_CACHE_TTL = int(os.environ.get('CART_CACHE_TTL', 24 * 60 * 60))
+
+# Seconds a request can run before Gunicorn kills its worker, gunicorn.conf.py reads the same variable
+GUNICORN_TIMEOUT = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# Seconds the response to an Idempotency-Key is kept for replay, and how long a retry waits for the first request
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 10))
+# Seconds the key of a request still running stays claimed, so a worker killed mid-request frees it. A request can't
+# outlive the Gunicorn timeout of a sync worker, a shorter one would let a retry run the view a second time next to it.
+IDEMPOTENCY_IN_FLIGHT_TIMEOUT = int(os.environ.get('IDEMPOTENCY_IN_FLIGHT_TIMEOUT', 60))
+if not 0 < GUNICORN_TIMEOUT < IDEMPOTENCY_IN_FLIGHT_TIMEOUT:
+    raise ImproperlyConfigured(f'IDEMPOTENCY_IN_FLIGHT_TIMEOUT ({IDEMPOTENCY_IN_FLIGHT_TIMEOUT}s) must be longer than '
+                               f'a positive GUNICORN_TIMEOUT ({GUNICORN_TIMEOUT}s), or a retry could run a request '
+                               f'that is still running')
+
+# Seconds a product added to a cart stays reserved for it, 0 disables the reservations. The expired holds are only
+# released by `python manage.py release_expired_reservations`, which entrypoint.sh runs every minute.
+STOCK_RESERVATION_TTL = int(os.environ.get('STOCK_RESERVATION_TTL', 15 * 60))
+
+# Background tasks are queued in the database. 'database' leaves them to `python manage.py run_tasks` workers, which
+# entrypoint.sh starts next to the web server. 'thread', for development only, runs them in TASK_THREADS threads of
+# the web process after the enqueuing transaction commits: they are lost for a while if it exits before they ran.
+TASK_EXECUTOR = os.environ.get('TASK_EXECUTOR', 'database')
+TASK_THREADS = int(os.environ.get('TASK_THREADS', 2))
+TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', 5))
+# Seconds a claimed task stays hidden from the other workers
+TASK_LEASE = int(os.environ.get('TASK_LEASE', 300))
+
+# Open the database connections and prime the caches in every Gunicorn worker before it accepts traffic
+STARTUP_WARMUP = os.environ.get('STARTUP_WARMUP', 'True') == 'True'
+
+# Seconds the order statistics stay cached, they are also invalidated on every order change
+ORDER_STATISTICS_CACHE_TTL = int(os.environ.get('ORDER_STATISTICS_CACHE_TTL', 30))
+
+# ecommerce_api/asgi.py switches to ecommerce_api.urls_asgi, which routes the hot read endpoints to async views
+ROOT_URLCONF = os.environ.get('DJANGO_ROOT_URLCONF', 'ecommerce_api.urls')
 
 TEMPLATES = [
     {
@@ -66,6 +165,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'ecommerce_api.wsgi.application'
+ASGI_APPLICATION = 'ecommerce_api.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -95,6 +195,23 @@ if os.getenv("DATABASE_URL") is None: # Local, no railway => Use sqlite
         }
     }
 
+# Read replicas, as database URLs separated by commas, e.g. sqlite:////tmp/replica.sqlite3 locally. They become the
+# replica1, replica2... aliases, read by the views decorated with @replica_reads (ecommerce_api/replicas.py).
+REPLICA_DATABASES = []
+for number, url in enumerate(filter(None, os.environ.get('REPLICA_DATABASE_URLS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = dict(dj_database_url.parse(url.strip(), conn_max_age=600),
+                                         TEST={'MIRROR': 'default'})
+    REPLICA_DATABASES.append(f'replica{number}')
+if REPLICA_DATABASES:
+    DATABASE_ROUTERS = ['ecommerce_api.replicas.ReplicaRouter']
+# Seconds the reads of a user who just wrote, or of data that just changed, stay on the primary. Whether they do is
+# kept in the cache, which must be shared: the next request of a user can be served by any worker.
+if REPLICA_DATABASES and CACHE_BACKEND not in SHARED_CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"REPLICA_DATABASE_URLS needs CACHE_BACKEND={' or '.join(SHARED_CACHE_BACKENDS)}, "
+                               f"the other '{CACHE_BACKEND}' processes would not send the reads of a user who "
+                               f"just wrote to the primary")
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
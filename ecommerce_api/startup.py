@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+
+def load_views():
+    # Resolving the URLconf imports every view, serializer and model module the first request would otherwise import
+    get_resolver().url_patterns
+
+
+def warmup():
+    # Runs in every worker before it accepts traffic (see gunicorn.conf.py): the first requests then find the
+    # code imported, the database connections open and the shared cache entries computed. Returns its duration.
+    from orders import statistics
+    from products.cache import get_catalog_last_modified, get_catalog_version
+
+    if not settings.STARTUP_WARMUP:
+        return 0.0
+    start = time.perf_counter()
+    load_views()
+    try:
+        for connection in connections.all():
+            connection.ensure_connection()
+        get_catalog_version()
+        get_catalog_last_modified()
+        statistics.get_statistics()
+    except Exception:
+        # The worker can still serve, its first requests just pay for it
+        logger.exception('Warmup failed')
+    return time.perf_counter() - start
@@ -0,0 +1,11 @@
+import csv
+
+
+class Echo:
+    # File-like object whose write() returns the data, lets csv.writer produce lines for streaming
+    def write(self, value):
+        return value
+
+
+def csv_writer():
+    return csv.writer(Echo())
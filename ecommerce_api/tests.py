@@ -0,0 +1,269 @@
+from datetime import timedelta
+
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from cart.models import Cart, CartItem
+from ecommerce_api import query_budgets, replicas
+from ecommerce_api.management.commands import check_query_plans
+from ecommerce_api.models import IdempotencyKey
+from orders.models import Order
+from products.models import Category, Product
+
+# Numbers of products, cart lines and orders seeded for each request
+BUDGET_SIZES = [1, 10, 50]
+
+# A database standing in for a read replica: the test runner creates it next to the primary's test database, for
+# the tests that use it, and nothing copies the rows from one to the other
+REPLICA = 'replica_test'
+connections.settings.setdefault(REPLICA, {
+    **connections.settings[DEFAULT_DB_ALIAS], 'NAME': f'{connections.settings[DEFAULT_DB_ALIAS]["NAME"]}_replica',
+    'TEST': {**connections.settings[DEFAULT_DB_ALIAS]['TEST'], 'NAME': None, 'MIRROR': None}})
+
+
+# Hashing passwords properly would dominate the run time, it doesn't change the query count. The replicas are left
+# out, they can't see the uncommitted data of the scenarios.
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], REPLICA_DATABASES=[])
+class QueryBudgetTests(TestCase):
+    def assert_budgets(self):
+        # The async URLconf lists its async views in front of the sync ones, hence the same route twice
+        routes = list(dict.fromkeys(query_budgets.get_routes()))
+        self.assertEqual([route for route in routes if route not in query_budgets.SCENARIOS], [])
+        for route in routes:
+            budget = query_budgets.SCENARIOS[route][0]
+            for size in BUDGET_SIZES:
+                with self.subTest(route=route, size=size):
+                    # Each request gets fresh data and a cold cache, so authentication is counted too, and is rolled
+                    # back so destructive endpoints don't interfere with each other
+                    cache.clear()
+                    with transaction.atomic():
+                        dataset = query_budgets.Dataset(size)
+                        with self.assertNumQueries(budget.expected(size)):
+                            response = query_budgets.request(route, dataset)
+                        self.assertLess(response.status_code, 400)
+                        transaction.set_rollback(True)
+
+    def test_budgets(self):
+        self.assert_budgets()
+
+    @override_settings(ROOT_URLCONF='ecommerce_api.urls_asgi')
+    def test_async_budgets(self):
+        self.assert_budgets()
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.dataset = check_query_plans.Dataset(0.05)
+
+    def test_queries_use_an_index(self):
+        # Only SQLite and PostgreSQL plans are understood, see the check_query_plans command
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f'Query plans of {connection.vendor} are not supported')
+        for name, plan, problems in check_query_plans.explain_queries(self.dataset):
+            with self.subTest(query=name):
+                self.assertEqual(problems, [], plan)
+
+
+@override_settings(REPLICA_DATABASES=[REPLICA], DATABASE_ROUTERS=['ecommerce_api.replicas.ReplicaRouter'])
+class ReplicaTests(TestCase):
+    databases = {DEFAULT_DB_ALIAS, REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                   password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        # Only on the primary, as if the replica hadn't caught up yet
+        Order.objects.create(user=self.user, total='10.00')
+
+    def own_orders(self):
+        response = self.client.get('/orders/')
+        self.assertEqual(response.status_code, 200)
+        return len(response.json()['results'])
+
+    def assert_routing(self):
+        # Outside the read-only views every read goes to the primary
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.own_orders(), 0)
+
+        self.assertEqual(self.client.put('/auth/update/', {'username': 'renamed', 'email': 'renamed@example.com'},
+                                         format='json').status_code, 200)
+        self.assertEqual(self.own_orders(), 1)
+
+        # Back to the replica once the stickiness expired
+        cache.delete(replicas.sticky_key(replicas.user_scope(self.user)))
+        self.assertEqual(self.own_orders(), 0)
+
+    def test_routing_and_stickiness(self):
+        self.assert_routing()
+
+    @override_settings(ROOT_URLCONF='ecommerce_api.urls_asgi')
+    def test_async_routing_and_stickiness(self):
+        self.assert_routing()
+
+    def test_scope_stickiness(self):
+        with replicas.replica(None, 'catalog'):
+            self.assertFalse(Order.objects.exists())
+        replicas.stick('catalog')
+        with replicas.replica(None, 'catalog'):
+            self.assertTrue(Order.objects.exists())
+        with replicas.replica(None, 'statistics'):
+            self.assertFalse(Order.objects.exists())
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                   password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, url):
+        # The ids of every page, following the next cursors
+        pages = []
+        while url:
+            page = self.get(url)
+            pages.append([row['id'] for row in page['results']])
+            url = page['next']
+        return pages
+
+    def test_products_by_id(self):
+        category = Category.objects.create(name='Category')
+        ids = [Product.objects.create(name=f'Product {i}', description='Product', category=category, price='10.00',
+                                      stock_quantity=1).pk for i in range(5)]
+
+        first = self.get('/store/products/?page_size=2')
+        self.assertIsNone(first['previous'])
+        self.assertEqual(self.walk('/store/products/?page_size=2'), [ids[:2], ids[2:4], ids[4:]])
+
+        second = self.get(first['next'])
+        self.assertEqual([row['id'] for row in self.get(second['previous'])['results']], ids[:2])
+
+    def assert_orders_newest_first(self):
+        # Orders sharing a date are ordered by id, so none is skipped or repeated across pages
+        now = timezone.now()
+        orders = Order.objects.bulk_create(Order(user=self.user, total='10.00') for _ in range(5))
+        Order.objects.filter(pk__in=[order.pk for order in orders[:3]]).update(date=now - timedelta(days=1))
+        Order.objects.filter(pk__in=[order.pk for order in orders[3:]]).update(date=now)
+        ids = [order.pk for order in orders]
+
+        pages = self.walk('/orders/?page_size=2')
+        self.assertEqual(pages, [[ids[4], ids[3]], [ids[2], ids[1]], [ids[0]]])
+
+        # A new order doesn't shift the pages already handed out
+        first = self.get('/orders/?page_size=2')
+        Order.objects.create(user=self.user, total='10.00')
+        self.assertEqual([row['id'] for row in self.get(first['next'])['results']], [ids[2], ids[1]])
+
+    def test_own_orders_newest_first(self):
+        self.assert_orders_newest_first()
+
+    @override_settings(ROOT_URLCONF='ecommerce_api.urls_asgi')
+    def test_async_own_orders_newest_first(self):
+        self.assert_orders_newest_first()
+
+    def test_page_size_is_capped(self):
+        category = Category.objects.create(name='Category')
+        Product.objects.bulk_create(Product(name=f'Product {i}', description='Product', category=category,
+                                            price='10.00', stock_quantity=1) for i in range(201))
+        self.assertEqual(len(self.get('/store/products/?page_size=1000')['results']), 200)
+
+
+@override_settings(STOCK_RESERVATION_TTL=0)
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.customer = self.create_user('customer')
+        category = Category.objects.create(name='Category')
+        self.product = Product.objects.create(name='Product', description='Product', category=category,
+                                              price='10.00', stock_quantity=10)
+
+    @staticmethod
+    def create_user(username):
+        return CustomUser.objects.create_user(username=username, email=f'{username}@example.com', password='password')
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+        return client
+
+    def add(self, user, quantity, key='add-1'):
+        return self.client_for(user).post('/cart/add/', {'product': self.product.pk, 'quantity': quantity},
+                                          format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_checkout_creates_one_order(self):
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2, discounted_price='10.00')
+        client = self.client_for(self.customer)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = client.post('/orders/checkout/', format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        retry = client.post('/orders/checkout/', format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+
+        self.assertEqual(first.status_code, 201, first.data)
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 8)
+
+    def test_key_reused_with_another_body_is_refused(self):
+        self.assertEqual(self.add(self.customer, 1).status_code, 200)
+
+        response = self.add(self.customer, 2)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['error'], 'Idempotency-Key was already used with a different request')
+        self.assertEqual(CartItem.objects.get(cart__user=self.customer).quantity, 1)
+
+    def test_key_length_is_checked(self):
+        response = self.add(self.customer, 1, key='k' * 256)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Idempotency-Key must be 1 to 255 characters long')
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.add(self.customer, 1, key='k' * 255).status_code, 200)
+
+    def test_keys_are_scoped_to_the_user(self):
+        other = self.create_user('other')
+        self.assertEqual(self.add(self.customer, 1).status_code, 200)
+
+        response = self.add(other, 3)
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(response.data['item_count'], 3)
+        self.assertEqual(IdempotencyKey.objects.count(), 2)
+
+    def test_purge_deletes_the_expired_keys(self):
+        self.assertEqual(self.add(self.customer, 1).status_code, 200)
+        self.assertEqual(self.add(self.customer, 1, key='add-2').status_code, 200)
+        IdempotencyKey.objects.filter(pk=IdempotencyKey.objects.earliest('pk').pk).update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+
+        call_command('purge_idempotency_keys', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Purged 1 expired idempotency keys.')
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+        # The expired key is free again, its retry runs the view
+        response = self.add(self.customer, 1)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(response.data['item_count'], 3)
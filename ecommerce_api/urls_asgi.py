@@ -0,0 +1,13 @@
+from django.urls import path, include
+
+from cart.urls import async_urlpatterns as cart_urlpatterns
+from orders.urls import async_urlpatterns as orders_urlpatterns
+from products.urls import async_urlpatterns as products_urlpatterns
+
+# Same routes as ecommerce_api/urls.py, with the hot read endpoints served by async views
+urlpatterns = [
+    path('auth/', include('accounts.urls')),
+    path('store/', include(products_urlpatterns)),
+    path('cart/', include(cart_urlpatterns)),
+    path('orders/', include(orders_urlpatterns)),
+]
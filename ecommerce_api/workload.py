@@ -0,0 +1,221 @@
+import asyncio
+import math
+import time
+from collections import defaultdict
+
+from django.test import AsyncClient
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from cart.models import Discount
+from ecommerce_api.datagen import ADMIN_EMAIL, NOUNS, PASSWORD
+from ecommerce_api.middleware import QueryRecorder
+from orders.models import Order
+from products.models import Product
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of an already sorted list
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Results:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def add(self, endpoint, seconds, queries, status_code):
+        self.samples[endpoint].append((seconds, queries, status_code))
+
+    @staticmethod
+    def summarize(samples):
+        latencies = sorted(seconds for seconds, queries, status_code in samples)
+        # Not recorded when concurrent requests share the database connections
+        queries = [count for seconds, count, status_code in samples if count is not None] or [None]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for seconds, count, status_code in samples if status_code >= 400),
+            'mean_ms': round(1000 * sum(latencies) / len(latencies), 3),
+            'p50_ms': round(1000 * percentile(latencies, 50), 3),
+            'p95_ms': round(1000 * percentile(latencies, 95), 3),
+            'p99_ms': round(1000 * percentile(latencies, 99), 3),
+            'max_ms': round(1000 * latencies[-1], 3),
+            # Requests per second a single worker sustains on this endpoint
+            'throughput_rps': round(len(latencies) / sum(latencies), 1),
+            'queries_mean': round(sum(queries) / len(queries), 2) if queries[0] is not None else None,
+            'queries_max': max(queries) if queries[0] is not None else None,
+        }
+
+    def report(self, wall_time):
+        all_samples = [sample for samples in self.samples.values() for sample in samples]
+        total = self.summarize(all_samples)
+        total['wall_time_s'] = round(wall_time, 3)
+        total['throughput_rps'] = round(len(all_samples) / wall_time, 1)
+        return {
+            'endpoints': {endpoint: self.summarize(samples) for endpoint, samples in sorted(self.samples.items())},
+            'total': total,
+        }
+
+
+# Replays a mix of customer and admin traffic against the generated dataset, see ecommerce_api.datagen.
+# Every operation is a generator yielding (endpoint, user, method, path, data) requests and receiving
+# (status code, JSON body) replies, so the same mix runs through the sync test client, as a WSGI worker
+# serves it, and through the async one, as the ASGI application serves it.
+class Workload:
+    # Relative frequency of each operation
+    MIX = {
+        'browse_products': 30,
+        'browse_categories': 8,
+        'search_products': 10,
+        'view_cart': 12,
+        'add_to_cart': 14,
+        'apply_discount': 3,
+        'checkout': 5,
+        'list_orders': 8,
+        'order_details': 6,
+        'statistics': 2,
+        'login': 1,
+        'register': 1,
+    }
+    ADMIN = 'admin'
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.results = Results()
+        tokens = Token.objects.filter(user__is_staff=False).values_list('user_id', 'key', 'user__email')
+        self.tokens = {user_id: key for user_id, key, email in tokens}
+        self.emails = {user_id: email for user_id, key, email in tokens}
+        self.tokens[self.ADMIN] = Token.objects.get(user__email=ADMIN_EMAIL).key
+        self.customer_ids = sorted(self.emails)
+        self.orders = defaultdict(list)
+        for user_id, order_id in Order.objects.values_list('user_id', 'pk'):
+            self.orders[user_id].append(order_id)
+        self.product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        self.discount_codes = list(Discount.objects.order_by('pk').values_list('code', flat=True))
+        self.operations = list(self.MIX)
+        self.weights = list(self.MIX.values())
+        self.registered = 0
+        self.sync_clients = {}
+        self.async_client = AsyncClient()
+
+    def next_operation(self):
+        return getattr(self, self.rng.choices(self.operations, self.weights)[0])()
+
+    def run(self, requests):
+        done = 0
+        while done < requests:
+            operation = self.next_operation()
+            reply = None
+            try:
+                while True:
+                    reply = self.send(*operation.send(reply))
+                    done += 1
+            except StopIteration:
+                pass
+
+    async def arun(self, requests, concurrency):
+        # concurrency virtual users share the request count, each one waiting for its own replies
+        done = 0
+
+        async def virtual_user():
+            nonlocal done
+            while done < requests:
+                operation = self.next_operation()
+                reply = None
+                try:
+                    while True:
+                        request = operation.send(reply)
+                        done += 1
+                        reply = await self.asend(*request, record_queries=concurrency == 1)
+                except StopIteration:
+                    pass
+
+        await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+
+    def send(self, endpoint, user, method, path, data=None):
+        if user not in self.sync_clients:
+            self.sync_clients[user] = APIClient()
+            if user is not None:
+                self.sync_clients[user].credentials(HTTP_AUTHORIZATION=f'Token {self.tokens[user]}')
+        with QueryRecorder() as recorder:
+            start = time.perf_counter()
+            response = getattr(self.sync_clients[user], method)(path, data, format='json')
+            elapsed = time.perf_counter() - start
+        self.results.add(endpoint, elapsed, recorder.count, response.status_code)
+        return response.status_code, self.json(response)
+
+    async def asend(self, endpoint, user, method, path, data=None, record_queries=True):
+        headers = {'Authorization': f'Token {self.tokens[user]}'} if user is not None else {}
+        args = (path,) if data is None else (path, data)
+        async with QueryRecorder() as recorder:
+            start = time.perf_counter()
+            response = await getattr(self.async_client, method)(*args, content_type='application/json',
+                                                                headers=headers)
+            elapsed = time.perf_counter() - start
+        self.results.add(endpoint, elapsed, recorder.count if record_queries else None, response.status_code)
+        return response.status_code, self.json(response)
+
+    @staticmethod
+    def json(response):
+        return response.json() if response.get('Content-Type', '').startswith('application/json') else None
+
+    def pick_customer(self):
+        return self.rng.choice(self.customer_ids)
+
+    def browse_products(self):
+        status_code, body = yield 'GET /store/products/', None, 'get', '/store/products/', {'page_size': 20}
+        if status_code == 200 and body['next'] and self.rng.random() < 0.5:
+            yield 'GET /store/products/', None, 'get', body['next']
+
+    def browse_categories(self):
+        yield 'GET /store/categories/', None, 'get', '/store/categories/'
+
+    def search_products(self):
+        yield 'GET /store/products/search/', None, 'get', '/store/products/search/', {
+            'q': self.rng.choice(NOUNS), 'in_stock': 'true'}
+
+    def view_cart(self):
+        yield 'GET /cart/', self.pick_customer(), 'get', '/cart/'
+
+    def add_to_cart(self):
+        yield 'POST /cart/add/', self.pick_customer(), 'post', '/cart/add/', {
+            'product': self.rng.choice(self.product_ids), 'quantity': self.rng.randint(1, 2)}
+
+    def apply_discount(self):
+        yield 'POST /cart/apply_discount/', self.pick_customer(), 'post', '/cart/apply_discount/', {
+            'discount_code': self.rng.choice(self.discount_codes)}
+
+    def checkout(self):
+        user_id = self.pick_customer()
+        status_code, body = yield 'POST /orders/checkout/', user_id, 'post', '/orders/checkout/'
+        if status_code == 201:
+            self.orders[user_id].append(body['order_id'])
+        else:
+            # Empty cart or not enough stock: the customer gives up on this cart
+            yield 'DELETE /cart/clear/', user_id, 'delete', '/cart/clear/'
+
+    def list_orders(self):
+        yield 'GET /orders/', self.pick_customer(), 'get', '/orders/'
+
+    def order_details(self):
+        user_id = self.pick_customer()
+        if self.orders[user_id]:
+            yield 'GET /orders/<pk>/', user_id, 'get', f'/orders/{self.rng.choice(self.orders[user_id])}/'
+        else:
+            yield 'GET /orders/', user_id, 'get', '/orders/'
+
+    def statistics(self):
+        yield 'GET /orders/stats/', self.ADMIN, 'get', '/orders/stats/'
+
+    def login(self):
+        yield 'POST /auth/login/', None, 'post', '/auth/login/', {
+            'email': self.emails[self.pick_customer()], 'password': PASSWORD}
+
+    def register(self):
+        self.registered += 1
+        name = f'bench-new-{self.registered}'
+        status_code, body = yield 'POST /auth/register/', None, 'post', '/auth/register/', {
+            'username': name, 'email': f'{name}@example.com', 'password': PASSWORD, 'password_confirm': PASSWORD}
+        if status_code == 201:
+            self.tokens[body['user']['id']] = body['token']
+            self.emails[body['user']['id']] = body['user']['email']
+            self.customer_ids.append(body['user']['id'])
@@ -1,5 +1,21 @@
 #!/bin/sh
 
-python manage.py makemigrations accounts products cart orders
-python manage.py migrate
-gunicorn ecommerce_api.wsgi:application --bind 0.0.0.0:8000
+# One key per container, shared by all the workers, see SECRET_KEY in ecommerce_api/settings.py
+SECRET_KEY_FILE=${SECRET_KEY_FILE:-secret.txt}
+if [ -z "$SECRET_KEY" ] && [ ! -f "$SECRET_KEY_FILE" ]; then
+    python -c "import secrets; print(secrets.token_urlsafe(50))" > "$SECRET_KEY_FILE"
+fi
+
+python manage.py migrate --noinput
+# Background task worker, see TASK_EXECUTOR in ecommerce_api/settings.py, and the sweeper of the expired stock
+# reservations, see STOCK_RESERVATION_TTL. RUN_TASKS=False when they run as services of their own.
+if [ "${RUN_TASKS:-True}" = "True" ]; then
+    python manage.py run_tasks &
+    python manage.py release_expired_reservations --interval 60 &
+fi
+if [ "$ASGI" = "True" ]; then
+    # Async read views served by uvicorn workers, see ecommerce_api/asgi.py
+    gunicorn ecommerce_api.asgi:application --config gunicorn.conf.py --worker-class uvicorn_worker.UvicornWorker
+else
+    gunicorn ecommerce_api.wsgi:application --config gunicorn.conf.py
+fi
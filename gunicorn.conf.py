@@ -0,0 +1,26 @@
+import os
+
+bind = '0.0.0.0:8000'
+# Seconds before a silent worker is killed and restarted, see IDEMPOTENCY_IN_FLIGHT_TIMEOUT in ecommerce_api/settings.py
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# Import Django, the apps and the views once in the master, the workers fork with them already loaded
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True') == 'True'
+
+
+def when_ready(server):
+    if preload_app:
+        from ecommerce_api.startup import load_views
+        load_views()
+
+
+def post_worker_init(worker):
+    # Connections can't be shared across the fork, so every worker opens its own before accepting traffic
+    from ecommerce_api.startup import warmup
+    worker.log.info('Warmed up in %.1f ms', warmup() * 1000)
+
+
+def worker_exit(server, worker):
+    # Write back the cached carts still waiting for their delayed flush (CART_BACKEND=cache)
+    from cart.store import flush_pending
+    flush_pending()
@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory.models import StockMovement, StockSnapshot
+from products.models import Product
+
+# Inventory ledger: whatever changes the stock of a product also appends a StockMovement, in the same transaction, so
+# every write of Product.stock_quantity (the cached on-hand balance the API reads) has its auditable counterpart.
+# The ledger balance of a product is its snapshot plus the movements not compacted yet; compact() (the
+# compact_stock_ledger command) folds the old movements into the snapshots, so it never has to sum the whole history.
+
+SALE, CANCEL, RESTORE, ADJUST = 'S', 'C', 'R', 'A'
+# Sign of the stock change of each kind, callers pass positive quantities except for the signed adjustments
+SIGNS = {SALE: -1, CANCEL: 1, RESTORE: -1, ADJUST: 1}
+
+
+def record(kind, quantities, order_id=None):
+    # quantities maps product id -> quantity moved
+    record_orders(kind, [(order_id, quantities)])
+
+
+def record_orders(kind, orders):
+    # orders lists (order id, {product id: quantity}) pairs, all appended with a single INSERT
+    now = timezone.now()
+    StockMovement.objects.bulk_create(
+        StockMovement(product_id=product_id, kind=kind, quantity=SIGNS[kind] * quantity, order_id=order_id,
+                      created_at=now)
+        for order_id, quantities in orders for product_id, quantity in quantities.items() if quantity)
+
+
+def open_balances(products):
+    # Snapshots of the current stock of products created without going through the ledger, e.g. bulk seeded ones
+    StockSnapshot.objects.bulk_create(StockSnapshot(product_id=product.pk, quantity=product.stock_quantity)
+                                      for product in products)
+
+
+def balances():
+    # The products annotated with their ledger balance
+    snapshot = StockSnapshot.objects.filter(product=OuterRef('pk')).values('quantity')
+    movements = StockMovement.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    return Product.objects.annotate(
+        ledger_balance=Coalesce(Subquery(snapshot), 0)
+        + Coalesce(Subquery(movements.annotate(total=Sum('quantity')).values('total')), 0))
+
+
+def discrepancies():
+    # Products whose cached stock doesn't match their ledger
+    return balances().exclude(stock_quantity=F('ledger_balance'))
+
+
+def compact(before, batch_size=1000):
+    # Folds the movements created before `before` into the snapshots, in batches each in its own short transaction.
+    # A batch deletes exactly the movements it adds to the snapshots, so the balances never change.
+    folded = 0
+    while True:
+        with transaction.atomic():
+            batch = list(StockMovement.objects.select_for_update(skip_locked=True)
+                         .filter(created_at__lt=before).order_by('created_at')
+                         .values_list('pk', 'product_id', 'quantity')[:batch_size])
+            if not batch:
+                return folded
+            totals = defaultdict(int)
+            for pk, product_id, quantity in batch:
+                totals[product_id] += quantity
+            StockMovement.objects.filter(pk__in=[pk for pk, product_id, quantity in batch]).delete()
+            fold(totals)
+        folded += len(batch)
+
+
+def fold(totals):
+    # Adds totals (product id -> quantity) to the snapshots with one upsert
+    snapshot = connection.ops.quote_name(StockSnapshot._meta.db_table)
+    taken_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {snapshot} (product_id, quantity, taken_at) '
+            f'VALUES {", ".join(["(%s, %s, %s)"] * len(totals))} '
+            f'ON CONFLICT (product_id) DO UPDATE '
+            f'SET quantity = {snapshot}.quantity + excluded.quantity, taken_at = excluded.taken_at',
+            [value for product_id, quantity in totals.items() for value in (product_id, quantity, taken_at)])
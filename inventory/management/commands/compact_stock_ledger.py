@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventory.ledger import compact, discrepancies
+
+
+class Command(BaseCommand):
+    help = ('Folds the stock movements older than --days days into per-product snapshots, in batches. Runs once, '
+            'or forever with --interval.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=30, help='Age of the movements to compact.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of movements folded by each transaction.')
+        parser.add_argument('--interval', type=float,
+                            help='Seconds to wait between runs; without it the command runs once and exits.')
+        parser.add_argument('--verify', action='store_true',
+                            help='Then check that the stock of every product matches its ledger balance.')
+
+    def handle(self, *args, **options):
+        while True:
+            folded = compact(timezone.now() - timedelta(days=options['days']), options['batch_size'])
+            self.stdout.write(f'Compacted {folded} stock movements.')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+        if options['verify']:
+            mismatches = discrepancies().values_list('pk', 'stock_quantity', 'ledger_balance')
+            for pk, stock, balance in mismatches:
+                self.stdout.write(self.style.ERROR(f'Product {pk}: stock {stock}, ledger balance {balance}'))
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} product(s) do not match their ledger.')
+            self.stdout.write(self.style.SUCCESS('Every product matches its ledger.'))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Releases the expired stock reservations, in batches. Runs once, or forever with --interval.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of reservations released by each transaction.')
+        parser.add_argument('--interval', type=float,
+                            help='Seconds to wait between sweeps; without it the command sweeps once and exits.')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired(options['batch_size'])
+            self.stdout.write(f'Released {released} expired reservations.')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,131 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections, transaction
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from ecommerce_api.workload import percentile
+from inventory import ledger, striping
+from products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = ('Runs the stock step of checkout (locking, taking and recording the stock) for one hot product from '
+            'concurrent workers in a throwaway test database, once with its stock in the single product row and once '
+            'split over --shards counters, and reports throughput and latency as JSON. The rest of a checkout (cart, '
+            'order rows) is not run, --hold-ms stands in for it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent threads, each with its connection.')
+        parser.add_argument('--sales', type=int, default=100, help='Sales made by each worker.')
+        parser.add_argument('--shards', type=int, default=8, help='Counters of the striped run.')
+        parser.add_argument('--hold-ms', type=float, default=5.0,
+                            help='Time each sale keeps its transaction open after taking the stock, standing in for '
+                                 'the rest of a checkout.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        report = {
+            'parameters': {key: options[key] for key in ('workers', 'sales', 'shards', 'hold_ms')},
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'runs': {},
+        }
+
+        setup_test_environment()
+        production_like = override_settings(DEBUG=False)
+        production_like.enable()
+        old_name = connection.settings_dict['NAME']
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        directory = None
+        if connection.vendor == 'sqlite':
+            # An in-memory database can't be written from several connections
+            directory = tempfile.mkdtemp()
+            test_settings['NAME'] = os.path.join(directory, 'stock_contention.sqlite3')
+            # SQLite ignores FOR UPDATE and can't upgrade a transaction that began with a read to a write while
+            # another one writes, take the write lock up front instead
+            database_options = connection.settings_dict.setdefault('OPTIONS', {})
+            old_options = dict(database_options)
+            database_options['transaction_mode'] = 'IMMEDIATE'
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            category = Category.objects.create(name='Contention')
+            for mode, shards in (('single', None), ('striped', options['shards'])):
+                stock = options['workers'] * options['sales']
+                product = Product.objects.create(name=f'Hot product ({mode})', description='', category=category,
+                                                 price='10.00', stock_quantity=stock)
+                if shards:
+                    striping.stripe(product, shards)
+                report['runs'][mode] = self.run(product, stock, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+                connection.settings_dict['OPTIONS'] = old_options
+            production_like.disable()
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+            self.stderr.write(f'Report written to {options["output"]}')
+        else:
+            self.stdout.write(output, ending='')
+
+    @staticmethod
+    def run(product, stock, options):
+        hold = options['hold_ms'] / 1000
+        latencies, errors = [], []
+        start_line = threading.Barrier(options['workers'])
+
+        def worker():
+            start_line.wait()
+            try:
+                for _ in range(options['sales']):
+                    start = time.perf_counter()
+                    try:
+                        # The stock step of checkout without reservations, see orders.views.checkout
+                        with transaction.atomic():
+                            products = striping.lock([product.pk])
+                            if not Product.reduce_stock_bulk({product.pk: 1}, striping.striped(products.values())):
+                                raise DatabaseError('out of stock')
+                            ledger.record(ledger.SALE, {product.pk: 1})
+                            time.sleep(hold)
+                    except DatabaseError as exc:
+                        errors.append(str(exc))
+                    else:
+                        latencies.append(time.perf_counter() - start)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        product.refresh_from_db()
+        latencies.sort()
+        return {
+            'sales': len(latencies),
+            'errors': len(errors),
+            'throughput_sps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(1000 * percentile(latencies, 50), 3) if latencies else None,
+            'p95_ms': round(1000 * percentile(latencies, 95), 3) if latencies else None,
+            'p99_ms': round(1000 * percentile(latencies, 99), 3) if latencies else None,
+            # Every sale must be accounted for exactly once
+            'consistent': product.stock_quantity == stock - len(latencies),
+        }
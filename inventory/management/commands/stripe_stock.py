@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import striping
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Splits the stock of hot products over several counters so concurrent checkouts don\'t queue on one row, '
+            'or merges it back with --shards 0.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='+', type=int)
+        parser.add_argument('--shards', type=int, default=8, help='Number of counters, 0 for a single counter.')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shards'] <= 256:
+            raise CommandError('--shards must be between 0 and 256.')
+        products = Product.objects.in_bulk(options['product_ids'])
+        missing = set(options['product_ids']) - set(products)
+        if missing:
+            raise CommandError(f'Unknown products: {", ".join(map(str, sorted(missing)))}')
+        for product in products.values():
+            striping.stripe(product, options['shards'])
+            self.stdout.write(f'{product.name}: stock split over {options["shards"] or 1} counter(s).')
@@ -0,0 +1,47 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    # The stock of the existing products becomes their opening snapshot
+    db = schema_editor.connection.alias
+    Product = apps.get_model('products', 'Product')
+    StockSnapshot = apps.get_model('inventory', 'StockSnapshot')
+    StockSnapshot.objects.using(db).bulk_create(
+        (StockSnapshot(product_id=pk, quantity=stock)
+         for pk, stock in Product.objects.using(db).values_list('pk', 'stock_quantity').iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_stockshard'),
+        ('products', '0006_product_stock_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='products.product')),
+                ('quantity', models.IntegerField(default=0)),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('S', 'Sale'), ('C', 'Cancelled order'), ('R', 'Restored order'), ('A', 'Adjustment')], max_length=1)),
+                ('quantity', models.IntegerField()),
+                ('order_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='inventory_movement_created_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+from django.db import models
+from django.utils import timezone
+
+from cart.models import Cart
+from products.models import Product
+
+
+# Quantity of a product held by the active reservations, updated with every hold and release so the available
+# stock (Product.stock_quantity - quantity) is read without summing the reservations
+class ReservedStock(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='reserved')
+    quantity = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} reserved"
+
+
+# Stock held for a cart line until the cart is checked out or cleared, or the hold expires
+class Reservation(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='inventory_reservation_unique_product'),
+        ]
+        indexes = [
+            # Expired holds, oldest first (release_expired)
+            models.Index(fields=['expires_at'], name='inventory_reservation_exp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product_id} for cart {self.cart_id}"
+
+
+# One of the counters the stock of a striped product is split into, see inventory/striping.py
+class StockShard(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='inventory_stockshard_unique_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}#{self.shard}: {self.quantity}"
+
+
+# A change of the stock of a product, never updated: the ledger is appended to by every sale, cancellation, restored
+# order and admin adjustment, in the transaction that changes Product.stock_quantity, which stays the cached balance.
+# Old movements are folded into the StockSnapshot of their product by inventory.ledger.compact().
+class StockMovement(models.Model):
+    KIND_CHOICES = [
+        ('S', 'Sale'),
+        ('C', 'Cancelled order'),
+        ('R', 'Restored order'),
+        ('A', 'Adjustment'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='movements')
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    # Signed change of the stock
+    quantity = models.IntegerField()
+    # Not a foreign key, the movements of a deleted order stay in the ledger
+    order_id = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Movements old enough to be compacted, oldest first (compact)
+            models.Index(fields=['created_at'], name='inventory_movement_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+} of {self.product_id}"
+
+
+# Sum of the compacted movements of a product: its stock is the snapshot plus the movements still in the ledger
+class StockSnapshot(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    quantity = models.IntegerField(default=0)
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} at {self.taken_at}"
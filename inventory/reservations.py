@@ -0,0 +1,144 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Case, F, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory import striping
+from inventory.models import Reservation, ReservedStock
+from products.models import Product
+
+# Stock reservations: adding a product to a cart holds the quantity for STOCK_RESERVATION_TTL seconds, checkout
+# turns the holds of the cart into a sale and clearing the cart releases them. Expired holds keep counting until
+# release_expired() (the release_expired_reservations command) sweeps them.
+
+
+def enabled():
+    return settings.STOCK_RESERVATION_TTL > 0
+
+
+def with_available(queryset):
+    # The products annotated with the stock no cart holds
+    reserved = ReservedStock.objects.filter(product=OuterRef('pk')).values('quantity')[:1]
+    return queryset.annotate(available=F('stock_quantity') - Coalesce(Subquery(reserved), 0))
+
+
+def available(product_id):
+    return with_available(Product.objects.filter(pk=product_id)).values_list('available', flat=True).first() or 0
+
+
+def reserved(product_id):
+    return ReservedStock.objects.filter(product_id=product_id).values_list('quantity', flat=True).first() or 0
+
+
+def reserve(cart_id, product_id, quantity):
+    # Holds quantity more of the product for the cart if that much is available, returns whether it did.
+    # The counter is raised with one conditional upsert, so concurrent holds can never exceed the stock.
+    reserved = connection.ops.quote_name(ReservedStock._meta.db_table)
+    reservation = connection.ops.quote_name(Reservation._meta.db_table)
+    product = connection.ops.quote_name(Product._meta.db_table)
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {reserved} (product_id, quantity) '
+            f'SELECT id, %s FROM {product} WHERE id = %s AND stock_quantity >= %s '
+            f'ON CONFLICT (product_id) DO UPDATE SET quantity = {reserved}.quantity + excluded.quantity '
+            f'WHERE {reserved}.quantity + excluded.quantity <= '
+            f'(SELECT stock_quantity FROM {product} WHERE id = excluded.product_id) '
+            f'RETURNING quantity',
+            [quantity, product_id, quantity])
+        if cursor.fetchone() is None:
+            return False
+        cursor.execute(
+            f'INSERT INTO {reservation} (cart_id, product_id, quantity, expires_at) VALUES (%s, %s, %s, %s) '
+            f'ON CONFLICT (cart_id, product_id) DO UPDATE '
+            f'SET quantity = {reservation}.quantity + excluded.quantity, expires_at = excluded.expires_at',
+            [cart_id, product_id, quantity, connection.ops.adapt_datetimefield_value(expires_at)])
+    return True
+
+
+def release_stock(quantities):
+    # quantities maps product id -> quantity no longer held, applied with a single UPDATE
+    if quantities:
+        ReservedStock.objects.filter(product_id__in=quantities).update(quantity=Case(
+            *(When(product_id=product_id, then=F('quantity') - quantity) for product_id, quantity in quantities.items()),
+            default=F('quantity'), output_field=models.PositiveIntegerField()))
+
+
+def held_by(reservations):
+    held = defaultdict(int)
+    for product_id, quantity in reservations.values_list('product_id', 'quantity'):
+        held[product_id] += quantity
+    return held
+
+
+def release_cart(cart_id):
+    with transaction.atomic(savepoint=False):
+        reservations = Reservation.objects.select_for_update().filter(cart_id=cart_id)
+        held = held_by(reservations)
+        if held:
+            reservations.delete()
+            release_stock(held)
+
+
+def trim_cart(cart_id, quantities):
+    # Releases the holds of the cart beyond quantities (product id -> quantity in the cart), e.g. those taken for the
+    # lines of a cached cart (cart/store.py) lost before they were written back
+    with transaction.atomic(savepoint=False):
+        reservations = list(Reservation.objects.select_for_update().filter(cart_id=cart_id))
+        excess = {reservation.product_id: reservation.quantity - quantities.get(reservation.product_id, 0)
+                  for reservation in reservations if reservation.quantity > quantities.get(reservation.product_id, 0)}
+        if not excess:
+            return
+        Reservation.objects.filter(pk__in=[reservation.pk for reservation in reservations
+                                           if not quantities.get(reservation.product_id)]).delete()
+        trimmed = [reservation for reservation in reservations
+                   if reservation.product_id in excess and quantities.get(reservation.product_id)]
+        for reservation in trimmed:
+            reservation.quantity = quantities[reservation.product_id]
+        Reservation.objects.bulk_update(trimmed, ['quantity'])
+        release_stock(excess)
+
+
+def claim(cart_id, quantities):
+    # For checkout, inside its transaction: drops the holds of the cart, whose stock is then sold, after checking that
+    # the lines whose hold was released (expired, or never taken) are still available. Returns the product that is
+    # not, if any, in which case the caller must roll back, and {product id: quantity} of quantities covered by the
+    # holds, which need no further stock check.
+    reservations = Reservation.objects.select_for_update().filter(cart_id=cart_id)
+    held = held_by(reservations)
+    missing = {product_id: quantity - held[product_id]
+               for product_id, quantity in quantities.items() if held[product_id] < quantity}
+    if missing:
+        # The striped products aren't locked, striping.take checks their stock once more when it is taken
+        products = striping.lock(missing, with_available(Product.objects.all()))
+        for product in products.values():
+            if product.available < missing[product.pk]:
+                return product, {}
+    if held:
+        reservations.delete()
+        release_stock(held)
+    return None, {product_id: min(quantity, held[product_id]) for product_id, quantity in quantities.items()
+                  if held[product_id]}
+
+
+def release_expired(batch_size=1000):
+    # Releases the expired holds in batches, each in its own short transaction; skip_locked lets several sweepers run
+    # and leaves alone the holds a checkout is claiming
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(Reservation.objects.select_for_update(skip_locked=True)
+                         .filter(expires_at__lte=timezone.now()).order_by('expires_at')
+                         .values_list('pk', 'product_id', 'quantity')[:batch_size])
+            if not batch:
+                return released
+            quantities = defaultdict(int)
+            for pk, product_id, quantity in batch:
+                quantities[product_id] += quantity
+            Reservation.objects.filter(pk__in=[pk for pk, product_id, quantity in batch]).delete()
+            release_stock(quantities)
+        released += len(batch)
@@ -0,0 +1,99 @@
+import random
+from functools import partial
+
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory.models import StockShard
+from products.cache import invalidate_stock
+from products.models import Product
+
+# Striped stock for hot products: the stock is split over Product.stock_shards counter rows, and every sale takes from
+# one shard picked at random, so concurrent checkouts of the same product lock different rows instead of queueing on
+# the product row. Product.stock_quantity stays the total, re-summed from the shards after each change commits.
+
+# Shards tried at random before taking from all of them at once
+ATTEMPTS = 2
+
+
+def split(stock, shards):
+    return [stock // shards + (1 if shard < stock % shards else 0) for shard in range(shards)]
+
+
+def stripe(product, shards, stock=None):
+    # Splits the stock of the product (its current total unless stock is given) over shards counters,
+    # or merges it back into stock_quantity with shards=None. Returns the total the product had before.
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product.pk)
+        previous = product.stock_quantity
+        if product.stock_shards:
+            previous = sum(StockShard.objects.select_for_update().filter(product=product)
+                           .values_list('quantity', flat=True))
+        if stock is None:
+            stock = previous
+        StockShard.objects.filter(product=product).delete()
+        if shards:
+            StockShard.objects.bulk_create(StockShard(product=product, shard=shard, quantity=quantity)
+                                           for shard, quantity in enumerate(split(stock, shards)))
+        Product.objects.filter(pk=product.pk).update(stock_quantity=stock, stock_shards=shards or None,
+                                                     updated_at=timezone.now())
+        invalidate_stock([product.pk])
+    return previous
+
+
+def take(product_id, shards, quantity):
+    # Takes quantity from a random shard with a conditional UPDATE. When the shards tried run low, locks all of
+    # them and spreads what is left evenly again. Returns False if the product lacks stock.
+    for shard in random.sample(range(shards), min(ATTEMPTS, shards)):
+        if StockShard.objects.filter(product_id=product_id, shard=shard, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity):
+            schedule_sync(product_id)
+            return True
+    with transaction.atomic():
+        rows = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard'))
+        stock = sum(row.quantity for row in rows)
+        if stock < quantity:
+            return False
+        for row, remaining in zip(rows, split(stock - quantity, len(rows))):
+            row.quantity = remaining
+        StockShard.objects.bulk_update(rows, ['quantity'])
+    schedule_sync(product_id)
+    return True
+
+
+def give(product_id, shards, quantity):
+    StockShard.objects.filter(product_id=product_id, shard=random.randrange(shards)).update(
+        quantity=F('quantity') + quantity)
+    schedule_sync(product_id)
+
+
+def schedule_sync(product_id):
+    # After the commit, so the product row is only locked for that one statement, not for the whole checkout
+    transaction.on_commit(partial(sync, [product_id]))
+
+
+def sync(product_ids):
+    shards = StockShard.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    total = Coalesce(Subquery(shards.annotate(total=Sum('quantity')).values('total')), 0,
+                     output_field=models.PositiveIntegerField())
+    Product.objects.filter(pk__in=product_ids, stock_shards__isnull=False).update(
+        stock_quantity=total, updated_at=timezone.now())
+
+
+def lock(product_ids, queryset=None):
+    # Loads the products in pk order, so concurrent callers cannot deadlock, locking FOR UPDATE only the single counter
+    # ones: take() checks the stock of the striped ones on their shards, so their row is never waited on. One query
+    # unless some of the products are striped.
+    queryset = (Product.objects.all() if queryset is None else queryset).filter(pk__in=product_ids).order_by('pk')
+    products = {product.pk: product for product in queryset.select_for_update().filter(stock_shards__isnull=True)}
+    rest = set(product_ids) - products.keys()
+    if rest:
+        products.update((product.pk, product) for product in queryset.filter(pk__in=rest))
+    return products
+
+
+def striped(products):
+    # Shard counts of the striped products among products, for Product.reduce_stock_bulk
+    return {product.pk: product.stock_shards for product in products if product.stock_shards}
@@ -0,0 +1,40 @@
+from django.db.models import Count, Max
+from rest_framework import status
+
+from ecommerce_api.async_api import apaginate, async_api_view, json_response
+from ecommerce_api.conditional import aconditional_response, make_etag
+from ecommerce_api.pagination import DateCursorPagination
+from ecommerce_api.replicas import replica_reads
+from orders.models import Order
+from orders.serializers import OrderItemSerializer, OrderSerializer
+
+
+# Async versions of the order history reads, served by the ASGI application (see ecommerce_api/urls_asgi.py)
+
+@async_api_view(login_required=True)
+@replica_reads()
+async def get_own_orders(request):
+    orders = Order.objects.filter(user=request.user)
+
+    state = await orders.aaggregate(count=Count('id'), last_modified=Max('updated_at'))
+    etag = make_etag(request.user.pk, state['count'], state['last_modified'], request.get_full_path())
+
+    async def get_page():
+        return json_response(await apaginate(DateCursorPagination(), orders, request, OrderSerializer))
+
+    return await aconditional_response(request, etag, state['last_modified'], get_page)
+
+
+@async_api_view(login_required=True)
+@replica_reads()
+async def get_order_details(request, pk):
+    try:
+        order = await Order.objects.aget(pk=pk)
+    except Order.DoesNotExist:
+        return json_response({'detail': 'No Order matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+    # Allow order owner and admin to GET it
+    if order.user_id != request.user.pk and not request.user.is_staff:
+        return json_response({'error': 'You do not have permission to view this order'},
+                             status=status.HTTP_403_FORBIDDEN)
+    items = [item async for item in order.items.select_related('product')]
+    return json_response(OrderItemSerializer(items, many=True).data)
@@ -0,0 +1,56 @@
+import json
+
+from django.db.models import Prefetch
+
+from ecommerce_api.streaming import csv_writer
+from orders.models import Order, OrderItem
+
+ORDER_FIELDS = ['id', 'user', 'user_email', 'date', 'status', 'total']
+ITEM_FIELDS = ['product', 'product_name', 'quantity', 'unit_price', 'total_price']
+
+
+def order_values(order):
+    return [order.id, order.user_id, order.user.email, order.date.isoformat(), order.status, order.total]
+
+
+def item_values(item):
+    return [item.product_id, item.product.name, item.quantity, item.unit_price, item.total_price]
+
+
+def export_lines(orders, file_format, include_items=False, chunk_size=1000):
+    # Yields the orders as CSV (one row per order line when items are included) or JSON lines.
+    # Rows are read with a server-side cursor and the items are prefetched one chunk of orders at a time.
+    orders = orders.select_related('user').order_by('pk')
+    if include_items:
+        orders = orders.prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    orders = orders.iterator(chunk_size=chunk_size)
+
+    if file_format == 'csv':
+        writer = csv_writer()
+        yield writer.writerow(ORDER_FIELDS + (ITEM_FIELDS if include_items else []))
+        for order in orders:
+            if not include_items:
+                yield writer.writerow(order_values(order))
+                continue
+            items = order.items.all()
+            for item in items:
+                yield writer.writerow(order_values(order) + item_values(item))
+            if not items:
+                yield writer.writerow(order_values(order) + [''] * len(ITEM_FIELDS))
+    else:
+        for order in orders:
+            record = dict(zip(ORDER_FIELDS, order_values(order)))
+            if include_items:
+                record['items'] = [dict(zip(ITEM_FIELDS, item_values(item))) for item in order.items.all()]
+            yield json.dumps(record, default=str) + '\n'
+
+
+def filter_orders(status=None, date_from=None, date_to=None):
+    orders = Order.objects.all()
+    if status:
+        orders = orders.filter(status=status)
+    if date_from:
+        orders = orders.filter(date__gte=date_from)
+    if date_to:
+        orders = orders.filter(date__lt=date_to)
+    return orders
@@ -19,6 +19,16 @@ class Order(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Own orders listing: one user's orders, newest first (DateCursorPagination)
+            models.Index(fields=['user', '-date', '-id'], name='orders_order_user_date_idx'),
+            # All orders listing, newest first, and the date range filter of the export
+            models.Index(fields=['-date', '-id'], name='orders_order_date_idx'),
+            # Export filtered by status, optionally within a date range
+            models.Index(fields=['status', 'date'], name='orders_order_status_date_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
@@ -17,3 +17,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['product', 'product_price', 'paid_price_per_unit', 'quantity', 'total_price']
+
+
+class OrderExportSerializer(serializers.Serializer):
+    file_format = serializers.ChoiceField(choices=['csv', 'jsonl'], default='jsonl')
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES, required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)  # inclusive
+    include_items = serializers.BooleanField(default=False)
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from ecommerce_api import replicas
+from orders.models import Order
+
+STATISTICS_CACHE_KEY = 'orders:statistics'
+
+
+def compute_statistics():
+    # Every counter and the revenue come from a single scan of the orders table
+    stats = Order.objects.aggregate(
+        total_orders=Count('id'),
+        cancelled_orders=Count('id', filter=Q(status='C')),
+        pending_orders=Count('id', filter=Q(status='P')),
+        shipped_orders=Count('id', filter=Q(status='S')),
+        delivered_orders=Count('id', filter=Q(status='D')),
+        total_revenue=Sum('total', filter=Q(status='D')),
+    )
+    stats['total_revenue'] = stats['total_revenue'] or 0.0
+    return stats
+
+
+def get_statistics():
+    stats = cache.get(STATISTICS_CACHE_KEY)
+    if stats is None:
+        stats = compute_statistics()
+        cache.set(STATISTICS_CACHE_KEY, stats, settings.ORDER_STATISTICS_CACHE_TTL)
+    return stats
+
+
+def drop_statistics():
+    cache.delete(STATISTICS_CACHE_KEY)
+    # Or a replica that hasn't caught up could cache the statistics again without the change
+    replicas.stick('statistics')
+
+
+def invalidate_statistics():
+    # Wait for the commit, otherwise a concurrent reader could cache the statistics again without the change,
+    # and a rolled back change would drop them for nothing
+    transaction.on_commit(drop_statistics)
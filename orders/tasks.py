@@ -0,0 +1,26 @@
+from collections import defaultdict
+
+from inventory import ledger
+from products.models import Product
+from tasks.queue import task
+
+
+def order_call(args):
+    # Tasks queued before the ledger carry the quantities alone, their movements are recorded without an order
+    if len(args) == 1:
+        return None, args[0]
+    return args
+
+
+@task(batched=True)
+def restore_stock(calls):
+    # Each call carries the id and the {product id: quantity} of a cancelled or deleted order. A batch is added back
+    # with one UPDATE and one ledger INSERT, whatever the number of orders and lines.
+    orders = [(order_id, {int(product_id): quantity for product_id, quantity in order_quantities.items()})
+              for order_id, order_quantities in map(order_call, calls)]
+    quantities = defaultdict(int)
+    for order_id, order_quantities in orders:
+        for product_id, quantity in order_quantities.items():
+            quantities[product_id] += quantity
+    Product.increase_stock_bulk(quantities)
+    ledger.record_orders(ledger.CANCEL, orders)
@@ -0,0 +1,246 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from cart.models import Cart, CartItem
+from inventory import ledger, reservations, striping
+from inventory.models import ReservedStock, StockMovement
+from orders import statistics
+from orders.models import Order, OrderItem
+from orders.tasks import restore_stock
+from products.models import Category, Product
+from tasks import queue
+from tasks.models import Task
+
+
+class BulkUpdateOrdersTests(TestCase):
+    def setUp(self):
+        admin = CustomUser.objects.create_user(username='admin', email='admin@example.com', password='password',
+                                               is_staff=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=admin).key}')
+        self.customer = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                       password='password')
+        category = Category.objects.create(name='Category')
+        self.short = self.create_product('Short', category, 1)
+        self.striped = self.create_product('Striped', category, 10)
+        striping.stripe(self.striped, 2)
+        self.other = self.create_product('Other', category, 10)
+
+    @staticmethod
+    def create_product(name, category, stock):
+        return Product.objects.create(name=name, description=name, category=category, price='10.00',
+                                      stock_quantity=stock)
+
+    def create_order(self, order_status, *lines):
+        order = Order.objects.create(user=self.customer, total='10.00', status=order_status)
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=quantity, unit_price='10.00',
+                                                total_price='10.00') for product, quantity in lines)
+        return order
+
+    def test_restore_orders_with_rejected_striped_order(self):
+        # The first order lacks stock for one product, its striped product must not be taken
+        rejected = self.create_order('C', (self.short, 5), (self.striped, 1))
+        accepted = self.create_order('C', (self.other, 3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/orders/bulk_update/', {'orders': [rejected.pk, accepted.pk],
+                                                                 'status': 'P'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['results'], [
+            {'order': rejected.pk, 'error': 'Insufficient stock for Short to restore order'},
+            {'order': accepted.pk, 'status': 'P'},
+        ])
+        self.assertEqual(Order.objects.get(pk=rejected.pk).status, 'C')
+        self.assertEqual(Order.objects.get(pk=accepted.pk).status, 'P')
+        stock = dict(Product.objects.values_list('pk', 'stock_quantity'))
+        self.assertEqual(stock, {self.short.pk: 1, self.striped.pk: 10, self.other.pk: 7})
+        self.assertEqual(sum(self.striped.shards.values_list('quantity', flat=True)), 10)
+
+    def test_reduce_stock_bulk_ignores_striped_products_not_taken(self):
+        self.striped.refresh_from_db()
+        self.assertTrue(Product.reduce_stock_bulk({self.other.pk: 2}, striping.striped([self.striped])))
+        self.assertEqual(Product.objects.get(pk=self.other.pk).stock_quantity, 8)
+        self.assertEqual(sum(self.striped.shards.values_list('quantity', flat=True)), 10)
+
+
+class StatisticsInvalidationTests(TestCase):
+    def setUp(self):
+        cache.delete(statistics.STATISTICS_CACHE_KEY)
+
+    def test_statistics_dropped_on_commit(self):
+        customer = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                  password='password')
+        self.assertEqual(statistics.get_statistics()['total_orders'], 0)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Order.objects.create(user=customer, total='10.00', status='P')
+            # Still cached until the commit
+            self.assertEqual(statistics.get_statistics()['total_orders'], 0)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(statistics.get_statistics()['total_orders'], 1)
+
+
+class RestoreStockTaskTests(TestCase):
+    def test_old_and_new_argument_shapes(self):
+        category = Category.objects.create(name='Category')
+        product = Product.objects.create(name='Product', description='Product', category=category, price='10.00',
+                                         stock_quantity=5)
+        customer = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                  password='password')
+        order = Order.objects.create(user=customer, total='10.00', status='C')
+        # Arguments go through JSON, so the product ids are strings
+        Task.objects.create(name=restore_stock.task_name, args=[{str(product.pk): 2}])
+        Task.objects.create(name=restore_stock.task_name, args=[order.pk, {str(product.pk): 3}])
+
+        self.assertEqual(queue.run_pending(), 2)
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(Product.objects.get(pk=product.pk).stock_quantity, 10)
+        self.assertEqual(list(StockMovement.objects.order_by('quantity').values_list('order_id', 'quantity')),
+                         [(None, 2), (order.pk, 3)])
+
+    def test_bad_call_does_not_fail_its_batch(self):
+        category = Category.objects.create(name='Category')
+        product = Product.objects.create(name='Product', description='Product', category=category, price='10.00',
+                                         stock_quantity=5)
+        Task.objects.create(name=restore_stock.task_name, args=[{str(product.pk): 2}])
+        bad = Task.objects.create(name=restore_stock.task_name, args=['not quantities'])
+        Task.objects.create(name=restore_stock.task_name, args=[{str(product.pk): 3}])
+
+        with self.assertLogs('tasks.queue', 'ERROR') as logs:
+            self.assertEqual(queue.run_pending(), 3)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(list(Task.objects.values_list('pk', flat=True)), [bad.pk])
+        self.assertIn('AttributeError', Task.objects.get(pk=bad.pk).last_error)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock_quantity, 10)
+
+
+class ReservedStockTests(TestCase):
+    def setUp(self):
+        self.customer = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                       password='password')
+        category = Category.objects.create(name='Category')
+        self.product = Product.objects.create(name='Product', description='Product', category=category,
+                                              price='10.00', stock_quantity=5)
+        self.cart = Cart.objects.create(user=self.customer)
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+        return client
+
+    def test_restore_cannot_take_held_stock(self):
+        admin = CustomUser.objects.create_user(username='admin', email='admin@example.com', password='password',
+                                               is_staff=True)
+        order = Order.objects.create(user=self.customer, total='20.00', status='C')
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price='10.00',
+                                 total_price='20.00')
+        self.assertTrue(reservations.reserve(self.cart.pk, self.product.pk, 4))
+
+        response = self.client_for(admin).put(f'/orders/update/{order.pk}/', {'status': 'P'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Insufficient stock for Product to restore order')
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'C')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 5)
+
+    def test_checkout_claims_the_held_stock(self):
+        self.assertTrue(reservations.reserve(self.cart.pk, self.product.pk, 5))
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=5, discounted_price='10.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.customer).post('/orders/checkout/', format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 0)
+        self.assertEqual(ReservedStock.objects.get(product=self.product).quantity, 0)
+        self.assertFalse(self.cart.reservations.exists())
+
+
+class UpdateOrderTests(TestCase):
+    def test_second_cancel_restores_nothing(self):
+        customer = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                  password='password')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=customer).key}')
+        category = Category.objects.create(name='Category')
+        product = Product.objects.create(name='Product', description='Product', category=category, price='10.00',
+                                         stock_quantity=5)
+        order = Order.objects.create(user=customer, total='20.00', status='P')
+        OrderItem.objects.create(order=order, product=product, quantity=2, unit_price='10.00', total_price='20.00')
+
+        self.assertEqual(client.put(f'/orders/update/{order.pk}/', {'status': 'C'}, format='json').status_code, 200)
+        response = client.put(f'/orders/update/{order.pk}/', {'status': 'C'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Only pending orders can be cancelled')
+        self.assertEqual(Task.objects.filter(name=restore_stock.task_name).count(), 1)
+
+
+@override_settings(STOCK_RESERVATION_TTL=0)
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.customer = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                       password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.customer).key}')
+        category = Category.objects.create(name='Category')
+        self.desk = Product.objects.create(name='Desk', description='Desk', category=category, price='100.00',
+                                           stock_quantity=10)
+        self.lamp = Product.objects.create(name='Lamp', description='Lamp', category=category, price='20.00',
+                                           stock_quantity=3)
+        self.cart = Cart.objects.create(user=self.customer)
+
+    def add_lines(self, *lines):
+        CartItem.objects.bulk_create(CartItem(cart=self.cart, product=product, quantity=quantity,
+                                              discounted_price=product.price) for product, quantity in lines)
+
+    def checkout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/orders/checkout/', format='json')
+
+    def stock(self):
+        return dict(Product.objects.values_list('name', 'stock_quantity'))
+
+    def test_checkout_takes_the_stock_of_every_line(self):
+        self.add_lines((self.desk, 2), (self.lamp, 3))
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get(pk=response.data['order_id'])
+        self.assertEqual(order.total, 260)
+        self.assertEqual(sorted(order.items.values_list('product__name', 'quantity')), [('Desk', 2), ('Lamp', 3)])
+        self.assertEqual(self.stock(), {'Desk': 8, 'Lamp': 0})
+        self.assertFalse(self.cart.items.exists())
+        self.assertEqual(StockMovement.objects.filter(order_id=order.pk, kind=ledger.SALE).count(), 2)
+
+    def test_short_line_creates_nothing(self):
+        self.add_lines((self.desk, 2), (self.lamp, 4))
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Insufficient stock for Lamp. Available: 3')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), {'Desk': 10, 'Lamp': 3})
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_failed_stock_update_rolls_back_the_order(self):
+        # The stock of a striped product is only checked when it is taken, after the order was written
+        striping.stripe(self.lamp, 2)
+        self.add_lines((self.desk, 2), (self.lamp, 4))
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Insufficient stock to complete the order')
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(StockMovement.objects.filter(kind=ledger.SALE).exists())
+        self.assertEqual(self.stock(), {'Desk': 10, 'Lamp': 3})
+        self.assertEqual(self.cart.items.count(), 2)
@@ -1,14 +1,23 @@
 from django.urls import path
 
+from . import async_views
 from .views import get_own_orders, delete_order, get_order_details, checkout, update_order, get_all_orders, \
-    get_statistics
+    get_statistics, export_orders, bulk_update_orders
 
 urlpatterns = [
     path('all/', get_all_orders, name='all-orders'),
+    path('export/', export_orders, name='export-orders'),
     path('', get_own_orders, name='order-list'),
     path('<int:pk>/', get_order_details, name='order-details'),
     path('checkout/', checkout, name='order-list'),
     path('update/<int:pk>/', update_order, name='update-order'),
+    path('bulk_update/', bulk_update_orders, name='bulk-update-orders'),
     path('delete/<int:pk>/', delete_order, name='delete-order'),
     path('stats/', get_statistics, name='get-statistics')
 ]
+
+# Served by the ASGI application in front of the sync views, see ecommerce_api/urls_asgi.py
+async_urlpatterns = [
+    path('', async_views.get_own_orders, name='order-list'),
+    path('<int:pk>/', async_views.get_order_details, name='order-details'),
+] + urlpatterns
@@ -1,106 +1,183 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
+from accounts.authentication import CachedTokenAuthentication
+from cart import store as cart_store
 from cart.models import Cart
+from ecommerce_api.conditional import conditional_response, make_etag
+from ecommerce_api.idempotency import idempotent
+from ecommerce_api.pagination import DateCursorPagination
+from ecommerce_api.replicas import replica_reads
+from inventory import ledger, reservations, striping
+from orders import export, statistics
 from orders.models import Order, OrderItem
-from orders.serializers import OrderSerializer, OrderItemSerializer
+from orders.serializers import OrderSerializer, OrderItemSerializer, OrderExportSerializer
+from orders.tasks import restore_stock
+from products.models import Product
 
 
 @api_view(['GET'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def get_all_orders(request):
     orders = Order.objects.all()
-    serializer = OrderSerializer(orders, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    paginator = DateCursorPagination()
+    page = paginator.paginate_queryset(orders, request)
+    serializer = OrderSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdminUser])
+def export_orders(request):
+    params = OrderExportSerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+    filters = params.validated_data
+
+    # Whole days in the server time zone, as half-open datetime ranges so the date index can be used
+    date_from = date_to = None
+    if filters.get('date_from'):
+        date_from = timezone.make_aware(datetime.combine(filters['date_from'], time.min))
+    if filters.get('date_to'):
+        date_to = timezone.make_aware(datetime.combine(filters['date_to'] + timedelta(days=1), time.min))
+
+    orders = export.filter_orders(filters.get('status'), date_from, date_to)
+    file_format = filters['file_format']
+    content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export.export_lines(orders, file_format, filters['include_items']),
+                                     content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="orders.{file_format}"'
+    return response
+
+
+@api_view(['GET'])
+@login_required
+@authentication_classes([CachedTokenAuthentication])
+@replica_reads()
 def get_own_orders(request):
     orders = Order.objects.filter(user=request.user)
-    serializer = OrderSerializer(orders, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+
+    # Any new, changed or deleted order changes the count or the latest updated_at, hence the ETag
+    state = orders.aggregate(count=Count('id'), last_modified=Max('updated_at'))
+    etag = make_etag(request.user.pk, state['count'], state['last_modified'], request.get_full_path())
+
+    def get_page():
+        paginator = DateCursorPagination()
+        page = paginator.paginate_queryset(orders, request)
+        serializer = OrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    return conditional_response(request, etag, state['last_modified'], get_page)
 
 
 @api_view(['POST'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
+@idempotent
+@cart_store.write_back
 def checkout(request):
     # Get the user's cart
     cart = get_object_or_404(Cart, user=request.user)
-    cart_items = cart.items.all()
+    cart_items = list(cart.items.all())
 
-    if not cart_items.exists():
+    if not cart_items:
         return Response(
             {'error': 'Cart is empty'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    # Calculate total with discounts
-    total_amount = Decimal('0.00')
-    order_items_data = []
-
+    # Quantity requested per product, in case the same product appears on several lines
+    quantities = defaultdict(int)
     for cart_item in cart_items:
-        product = cart_item.product
-        quantity = cart_item.quantity
-
-        # Check stock availability
-        if product.stock_quantity < quantity:
-            return Response(
-                {'error': f'Insufficient stock for {product.name}. Available: {product.stock_quantity}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        # Use discounted price if available, otherwise use original price
-        unit_price = cart_item.discounted_price if cart_item.discounted_price else product.price
-        item_total = unit_price * quantity
-        total_amount += item_total
-
-        order_items_data.append({
-            'product': product,
-            'quantity': quantity,
-            'unit_price': unit_price,
-            'total_price': item_total
-        })
-
-    # Create the order
-    order = Order.objects.create(
-        user=request.user,
-        total=total_amount,
-        status='P'
-    )
-
-    # Create order items and update product stock
-    for item_data in order_items_data:
-        OrderItem.objects.create(
-            order=order,
-            product=item_data['product'],
-            quantity=item_data['quantity'],
-            unit_price=item_data['unit_price'],
-            total_price=item_data['total_price']
+        quantities[cart_item.product_id] += cart_item.quantity
+
+    held = {}
+    with transaction.atomic():
+        if reservations.enabled():
+            # The stock of the lines is held for the cart, only the lines whose hold lapsed need a check
+            product, held = reservations.claim(cart.pk, quantities)
+            if product is not None:
+                transaction.set_rollback(True)
+                return Response(
+                    {'error': f'Insufficient stock for {product.name}. Available: {max(product.available, 0)}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            products = Product.objects.in_bulk(quantities)
+        else:
+            # Lock the products in a fixed order (by pk) so concurrent checkouts cannot deadlock, all but the
+            # striped ones, whose stock is checked on their shards when it is taken
+            products = striping.lock(quantities)
+
+            # Check stock availability
+            for product_id, quantity in quantities.items():
+                product = products[product_id]
+                if not product.stock_shards and product.stock_quantity < quantity:
+                    return Response(
+                        {'error': f'Insufficient stock for {product.name}. Available: {product.stock_quantity}'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
+        # Calculate total with discounts
+        total_amount = Decimal('0.00')
+        order_items = []
+
+        for cart_item in cart_items:
+            product = products[cart_item.product_id]
+            quantity = cart_item.quantity
+
+            # Use discounted price if available, otherwise use original price
+            unit_price = cart_item.discounted_price if cart_item.discounted_price else product.price
+            item_total = unit_price * quantity
+            total_amount += item_total
+
+            order_items.append(OrderItem(
+                product=product,
+                quantity=quantity,
+                unit_price=unit_price,
+                total_price=item_total
+            ))
+
+        # Create the order
+        order = Order.objects.create(
+            user=request.user,
+            total=total_amount,
+            status='P'
         )
 
-        # Update product stock
-        product = item_data['product']
-        if not product.reduce_stock(item_data['quantity']):
+        # Create all order items with a single insert
+        for order_item in order_items:
+            order_item.order = order
+        OrderItem.objects.bulk_create(order_items)
+
+        # Update product stock with one conditional UPDATE, undoing the whole order if any line is short. The
+        # quantities held for the cart are known to be in stock and not checked again.
+        if not Product.reduce_stock_bulk(quantities, striping.striped(products.values()), held):
+            transaction.set_rollback(True)
             return Response(
-                {'error': f'Insufficient stock for {product.name}. Available: {product.stock_quantity}'},
+                {'error': 'Insufficient stock to complete the order'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        ledger.record(ledger.SALE, quantities, order.pk)
 
-    # Clear the cart after successful order creation
-    cart.items.all().delete()
+        # Clear the cart after successful order creation
+        cart.items.all().delete()
+        cart.reset_totals()
 
     return Response({
         'message': 'Order created successfully',
@@ -109,17 +186,30 @@ def checkout(request):
     }, status=status.HTTP_201_CREATED)
 
 
+def admin_transition_error(current_status, new_status):
+    # Prevent certain invalid transitions
+    if current_status == 'C' and new_status != 'P':
+        return 'Cancelled orders can only be changed back to Pending'
+    if current_status == 'D':
+        return 'Delivered orders cannot be modified'
+    if current_status == 'S' and new_status == 'P':
+        return 'Shipped orders cannot be changed back to Pending'
+    return None
+
+
+def order_quantities(order):
+    # {product id: quantity} of the order's lines, as the stock tasks take them
+    quantities = defaultdict(int)
+    for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+        quantities[product_id] += quantity
+    return dict(quantities)
+
+
 @api_view(['PUT'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
+@idempotent
 def update_order(request, pk):
-    order = Order.objects.get(pk=pk)
-    if order.user != request.user and not request.user.is_staff:
-        return Response(
-            {'error': 'You do not have permission to update this order'},
-            status=status.HTTP_403_FORBIDDEN
-        )
-
     # Get the order status requested from request data
     new_status = request.data.get('status')
     if not new_status:
@@ -133,87 +223,191 @@ def update_order(request, pk):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    # Business logic for status transitions
-    current_status = order.status
-
-    # HANDLING OF BAD REQUESTS
-    # Regular users can only cancel pending orders
-    if not request.user.is_staff:
-        if new_status != 'C':
+    with transaction.atomic():
+        # Locked, so of two concurrent updates the second sees the status the first one set: an order can't be
+        # cancelled, and its stock restored, twice
+        order = Order.objects.select_for_update().get(pk=pk)
+        if order.user != request.user and not request.user.is_staff:
             return Response(
-                {'error': 'You can only cancel your orders'},
+                {'error': 'You do not have permission to update this order'},
                 status=status.HTTP_403_FORBIDDEN
             )
-        if current_status != 'P':
-            return Response(
-                {'error': 'Only pending orders can be cancelled'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
 
-    # Admin-specific status transition rules
-    if request.user.is_staff:
-        # Prevent certain invalid transitions
-        if current_status == 'C' and new_status != 'P':
-            return Response(
-                {'error': 'Cancelled orders can only be changed back to Pending'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        if current_status == 'D':
-            return Response(
-                {'error': 'Delivered orders cannot be modified'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        if current_status == 'S' and new_status == 'P':
-            return Response(
-                {'error': 'Shipped orders cannot be changed back to Pending'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-    # END OF HANDLING OF BAD REQUESTS
-
-    # Handle stock adjustments when cancelling an order
-    if current_status != 'C' and new_status == 'C':
-        # Restore stock for all items in the order
-        for item in order.items.all():
-            item.product.increase_stock(item.quantity)
-
-    # Handle stock adjustments when un-cancelling an order (admin only)
-    if current_status == 'C' and new_status == 'P' and request.user.is_staff:
-        # Check if we have enough stock to un-cancel
-        for item in order.items.all():
-            if item.product.stock_quantity < item.quantity:
+        # Business logic for status transitions
+        current_status = order.status
+
+        # HANDLING OF BAD REQUESTS
+        # Regular users can only cancel pending orders
+        if not request.user.is_staff:
+            if new_status != 'C':
+                return Response(
+                    {'error': 'You can only cancel your orders'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            if current_status != 'P':
                 return Response(
-                    {'error': f'Insufficient stock for {item.product.name} to restore order'},
+                    {'error': 'Only pending orders can be cancelled'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-        # Reduce stock for all items
-        for item in order.items.all():
-            item.product.reduce_stock(item.quantity)
-
-    # Update the status
-    order.status = new_status
-    order.save()
+        # Admin-specific status transition rules
+        if request.user.is_staff:
+            error = admin_transition_error(current_status, new_status)
+            if error:
+                return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        # END OF HANDLING OF BAD REQUESTS
+
+        # Handle stock adjustments when cancelling an order: the stock is restored by a background task,
+        # enqueued in the same transaction as the new status
+        if current_status != 'C' and new_status == 'C':
+            restore_stock.enqueue(order.pk, order_quantities(order))
+
+        # Handle stock adjustments when un-cancelling an order (admin only)
+        if current_status == 'C' and new_status == 'P' and request.user.is_staff:
+            # Check if we have enough stock to un-cancel, the stock held by carts isn't available to the order
+            quantities = order_quantities(order)
+            products = reservations.with_available(Product.objects.filter(pk__in=quantities)).in_bulk()
+            for product_id, quantity in quantities.items():
+                if products[product_id].available < quantity:
+                    return Response(
+                        {'error': f'Insufficient stock for {products[product_id].name} to restore order'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
+            # Reduce stock for all items with one conditional UPDATE
+            if not Product.reduce_stock_bulk(quantities, striping.striped(products.values())):
+                transaction.set_rollback(True)
+                return Response({'error': 'Insufficient stock to restore order'}, status=status.HTTP_400_BAD_REQUEST)
+            ledger.record(ledger.RESTORE, quantities, order.pk)
+
+        # Update the status
+        order.status = new_status
+        order.save()
 
     # Serialize and return the updated order
     serializer = OrderSerializer(order)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+# Most orders one bulk update can change
+MAX_BULK_ORDERS = 1000
+
+
+@api_view(['POST'])
+@login_required
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdminUser])
+@idempotent
+def bulk_update_orders(request):
+    new_status = request.data.get('status')
+    if not new_status:
+        return Response({'error': 'Status is required'}, status=status.HTTP_400_BAD_REQUEST)
+    valid_statuses = [choice[0] for choice in Order.STATUS_CHOICES]
+    if new_status not in valid_statuses:
+        return Response(
+            {'error': f'Invalid status. Valid choices are: {", ".join(valid_statuses)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    order_ids = request.data.get('orders')
+    if not isinstance(order_ids, list) or not 0 < len(order_ids) <= MAX_BULK_ORDERS or \
+            not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in order_ids):
+        return Response({'error': f'Orders must be a list of 1 to {MAX_BULK_ORDERS} order ids'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    order_ids = list(dict.fromkeys(order_ids))
+
+    errors = {}
+    with transaction.atomic():
+        # Load and lock every order of the batch with one query, the transitions are then checked in memory
+        orders = {order.pk: order for order in
+                  Order.objects.select_for_update().filter(pk__in=order_ids).only('pk', 'status').order_by('pk')}
+        cancelled, restored = [], []
+        for pk in order_ids:
+            order = orders.get(pk)
+            if order is None:
+                errors[pk] = 'Order not found'
+                continue
+            error = admin_transition_error(order.status, new_status)
+            if error:
+                errors[pk] = error
+            elif order.status != 'C' and new_status == 'C':
+                cancelled.append(order)
+            elif order.status == 'C' and new_status == 'P':
+                restored.append(order)
+
+        # {product id: quantity} of every order whose stock changes, from one query
+        lines = defaultdict(lambda: defaultdict(int))
+        for order_id, product_id, quantity in OrderItem.objects.filter(
+                order__in=[order.pk for order in cancelled + restored]).values_list('order_id', 'product_id',
+                                                                                    'quantity'):
+            lines[order_id][product_id] += quantity
+
+        # Un-cancelled orders take their stock back in the order they were given, as long as it lasts
+        if restored:
+            # The striped products aren't locked, their stock_quantity is only a guide and striping.take has the
+            # last word: if it runs out the whole batch is rolled back. The stock held by carts isn't available.
+            products = striping.lock({product_id for order in restored for product_id in lines[order.pk]},
+                                     reservations.with_available(Product.objects.all()))
+            taken = defaultdict(int)
+            for order in restored:
+                short = next((products[product_id] for product_id, quantity in lines[order.pk].items()
+                              if products[product_id].available < taken[product_id] + quantity), None)
+                if short:
+                    errors[order.pk] = f'Insufficient stock for {short.name} to restore order'
+                    continue
+                for product_id, quantity in lines[order.pk].items():
+                    taken[product_id] += quantity
+            # Only the products actually taken, those of the turned away orders stay out of the UPDATE
+            taken = {product_id: quantity for product_id, quantity in taken.items() if quantity}
+            if not Product.reduce_stock_bulk(taken, striping.striped(products[product_id] for product_id in taken)):
+                transaction.set_rollback(True)
+                return Response({'error': 'Insufficient stock to restore the orders'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            ledger.record_orders(ledger.RESTORE, [(order.pk, lines[order.pk]) for order in restored
+                                                  if order.pk not in errors])
+
+        # Cancelled orders give their stock back with one UPDATE for the whole batch
+        restock = defaultdict(int)
+        for order in cancelled:
+            for product_id, quantity in lines[order.pk].items():
+                restock[product_id] += quantity
+        Product.increase_stock_bulk(restock)
+        ledger.record_orders(ledger.CANCEL, [(order.pk, lines[order.pk]) for order in cancelled])
+
+        # Save every status with one UPDATE, which bypasses auto_now
+        changed = [orders[pk] for pk in order_ids if pk not in errors]
+        now = timezone.now()
+        for order in changed:
+            order.status = new_status
+            order.updated_at = now
+        Order.objects.bulk_update(changed, ['status', 'updated_at'])
+        # bulk_update sends no post_save signal
+        if changed:
+            statistics.invalidate_statistics()
+
+    return Response({
+        'updated': len(changed),
+        'results': [{'order': pk, 'error': errors[pk]} if pk in errors else {'order': pk, 'status': new_status}
+                    for pk in order_ids],
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
+@replica_reads()
 def get_order_details(request, pk):
     order = Order.objects.get(pk=pk)
     # Allow order owner and admin to GET it
-    if order.user != request.user and not request.user.is_staff:
+    if order.user_id != request.user.pk and not request.user.is_staff:
         return Response({'error': 'You do not have permission to view this order'}, status=status.HTTP_403_FORBIDDEN)
-    serializer = OrderItemSerializer(order.items.all(), many=True)
+    serializer = OrderItemSerializer(order.items.select_related('product'), many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 @api_view(['DELETE'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def delete_order(request, pk):
     order = Order.objects.get(pk=pk)
@@ -222,32 +416,19 @@ def delete_order(request, pk):
         return Response({'error': f'Order #{pk} is not pending nor cancelled and cannot be deleted'},
                         status=status.HTTP_403_FORBIDDEN)
 
-    for item in order.items.all():
-        item.product.increase_stock(item.quantity)
-
-    order.items.all().delete()
-    order.delete()
+    with transaction.atomic():
+        # The stock of a cancelled order was already restored when it was cancelled
+        if order.status == 'P':
+            restore_stock.enqueue(order.pk, order_quantities(order))
+        order.items.all().delete()
+        order.delete()
     return Response({'message': 'Order deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
 
 
 @api_view(['GET'])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
+@replica_reads('statistics')
 def get_statistics(request):
-    cancelled = Order.objects.filter(status='C').count()
-    pending = Order.objects.filter(status='P').count()
-    shipped = Order.objects.filter(status='S').count()
-    delivered = Order.objects.filter(status='D').count()
-    total = Order.objects.count()
-
-    total_revenue = Order.objects.filter(status='D').aggregate(total_revenue=Sum('total'))['total_revenue'] or 0.0
-
-    return Response({
-        'total_orders': total,
-        'cancelled_orders': cancelled,
-        'pending_orders': pending,
-        'shipped_orders': shipped,
-        'delivered_orders': delivered,
-        'total_revenue': total_revenue
-    }, status=status.HTTP_200_OK)
+    return Response(statistics.get_statistics(), status=status.HTTP_200_OK)
@@ -0,0 +1,17 @@
+from ecommerce_api.async_api import async_api_view
+from products.cache import acatalog_list
+from products.models import Category, Product
+from products.serializers import CategorySerializer, ProductSerializer
+
+
+# Async versions of the catalog listings, served by the ASGI application (see ecommerce_api/urls_asgi.py)
+
+@async_api_view()
+async def category_list(request):
+    return await acatalog_list(request, 'categories', Category.objects.all(), CategorySerializer)
+
+
+@async_api_view()
+async def product_list(request):
+    return await acatalog_list(request, 'products', Product.objects.select_related('category'), ProductSerializer,
+                               live_stock=True)
@@ -0,0 +1,196 @@
+import hashlib
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from ecommerce_api import replicas
+from ecommerce_api.async_api import apaginate, json_response
+from ecommerce_api.conditional import aconditional_response, conditional_response, make_etag
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_LAST_MODIFIED_KEY = 'catalog:last_modified'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock rather than from 1, so a version lost to eviction or a restart
+        # can never match entries cached under an older one
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def get_catalog_last_modified():
+    last_modified = cache.get(CATALOG_LAST_MODIFIED_KEY)
+    if last_modified is None:
+        dates = [apps.get_model('products', model).objects.aggregate(last=Max('updated_at'))['last']
+                 for model in ('Category', 'Product')]
+        last_modified = max((date for date in dates if date), default=timezone.now())
+        cache.add(CATALOG_LAST_MODIFIED_KEY, last_modified, None)
+    return last_modified
+
+
+async def aget_catalog_version():
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = await cache.aget(CATALOG_VERSION_KEY)
+    return version
+
+
+async def aget_catalog_last_modified():
+    last_modified = await cache.aget(CATALOG_LAST_MODIFIED_KEY)
+    if last_modified is None:
+        dates = [(await apps.get_model('products', model).objects.aaggregate(last=Max('updated_at')))['last']
+                 for model in ('Category', 'Product')]
+        last_modified = max((date for date in dates if date), default=timezone.now())
+        await cache.aadd(CATALOG_LAST_MODIFIED_KEY, last_modified, None)
+    return last_modified
+
+
+def bump_catalog_version():
+    # A new clock reading rather than incr(), which reads and writes in two steps on the file backend: two concurrent
+    # bumps could both write the same version, and a listing cached from the rows in between would outlive them
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
+    cache.set(CATALOG_LAST_MODIFIED_KEY, timezone.now(), None)
+    # Or a replica that hasn't caught up could cache the old rows under the new version
+    replicas.stick('catalog')
+
+
+def invalidate_catalog():
+    # Wait for the commit, otherwise a concurrent reader could cache the old rows under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+# Stock changes with every sale, so it is cached apart from the catalog entries, one key per product under the catalog
+# version: a sale drops the keys of its products instead of bumping the version of the whole catalog, and the product
+# listings and the cart store lay the current stock over their cached rows.
+
+def stock_key(version, product_id):
+    return f'catalog:{version}:stock:{product_id}'
+
+
+def stock_query(product_ids):
+    # Always from the primary, a lagging replica would cache the stock of before a sale
+    return apps.get_model('products', 'Product').objects.using(DEFAULT_DB_ALIAS).filter(
+        pk__in=product_ids).values_list('pk', 'stock_quantity')
+
+
+def get_stock(version, product_ids):
+    # product id -> current stock, the products missing from the cache are read with one query
+    keys = {product_id: stock_key(version, product_id) for product_id in product_ids}
+    cached = cache.get_many(keys.values())
+    stock = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+    missing = [product_id for product_id in product_ids if product_id not in stock]
+    if missing:
+        fetched = dict(stock_query(missing))
+        cache.set_many({keys[product_id]: quantity for product_id, quantity in fetched.items()},
+                       settings.STOCK_CACHE_TTL)
+        stock.update(fetched)
+    return stock
+
+
+async def aget_stock(version, product_ids):
+    keys = {product_id: stock_key(version, product_id) for product_id in product_ids}
+    cached = await cache.aget_many(keys.values())
+    stock = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+    missing = [product_id for product_id in product_ids if product_id not in stock]
+    if missing:
+        fetched = {product_id: quantity async for product_id, quantity in stock_query(missing)}
+        await cache.aset_many({keys[product_id]: quantity for product_id, quantity in fetched.items()},
+                              settings.STOCK_CACHE_TTL)
+        stock.update(fetched)
+    return stock
+
+
+def drop_stock(product_ids):
+    version = get_catalog_version()
+    cache.delete_many([stock_key(version, product_id) for product_id in product_ids])
+    # The listings show the stock, they are modified even though their entries stay valid
+    cache.set(CATALOG_LAST_MODIFIED_KEY, timezone.now(), None)
+
+
+def invalidate_stock(product_ids):
+    # After the commit, like invalidate_catalog, and after the re-sum of striped products scheduled before it
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: drop_stock(product_ids))
+
+
+def with_stock(rows, stock):
+    # Copies of the serialized product rows with their stock_quantity replaced by the current one
+    return [{**row, 'stock_quantity': stock[row['id']]} if row['id'] in stock else row for row in rows]
+
+
+def catalog_cache_key(name, request, version):
+    path = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'catalog:{version}:{name}:{path}'
+
+
+class CatalogCacheMixin:
+    # Serves list responses from the cache, one entry per URL (so per page, page size and filter).
+    # Every entry is keyed on the catalog version, which any product or category write bumps; the
+    # same version gives the ETag, so revalidating clients get a 304 without any database access.
+    # With live_stock, the stock of the listed products comes from the stock keys, which sales drop
+    # without bumping the version, and is part of the ETag.
+    cache_name = None
+    live_stock = False
+
+    def list(self, request, *args, **kwargs):
+        with replicas.replica(request.user, 'catalog'):
+            version = get_catalog_version()
+            key = catalog_cache_key(self.cache_name, request, version)
+            if not self.live_stock:
+                return conditional_response(request, make_etag(key), get_catalog_last_modified(),
+                                            lambda: self.cached_list(key, request, *args, **kwargs))
+            data = self.cached_data(key, request, *args, **kwargs)
+            stock = get_stock(version, [row['id'] for row in data['results']])
+            return conditional_response(request, make_etag(key, sorted(stock.items())), get_catalog_last_modified(),
+                                        lambda: Response({**data, 'results': with_stock(data['results'], stock)}))
+
+    def cached_data(self, key, request, *args, **kwargs):
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, settings.CATALOG_CACHE_TTL)
+        return data
+
+    def cached_list(self, key, request, *args, **kwargs):
+        return Response(self.cached_data(key, request, *args, **kwargs))
+
+
+async def acatalog_list(request, cache_name, queryset, serializer_class, live_stock=False):
+    # Async counterpart of CatalogCacheMixin.list, sharing its cache entries: a cache hit or a 304
+    # is answered without leaving the event loop
+    version = await aget_catalog_version()
+    key = catalog_cache_key(cache_name, request, version)
+
+    async def get_data():
+        data = await cache.aget(key)
+        if data is None:
+            data = await apaginate(api_settings.DEFAULT_PAGINATION_CLASS(), queryset, request, serializer_class)
+            await cache.aset(key, data, settings.CATALOG_CACHE_TTL)
+        return data
+
+    async def get_response():
+        return json_response(await get_data())
+
+    async with replicas.areplica(request.user, 'catalog'):
+        if not live_stock:
+            return await aconditional_response(request, make_etag(key), await aget_catalog_last_modified(),
+                                               get_response)
+        data = await get_data()
+        stock = await aget_stock(version, [row['id'] for row in data['results']])
+
+        async def get_stock_response():
+            return json_response({**data, 'results': with_stock(data['results'], stock)})
+
+        return await aconditional_response(request, make_etag(key, sorted(stock.items())),
+                                           await aget_catalog_last_modified(), get_stock_response)
@@ -0,0 +1,151 @@
+import csv
+import json
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from ecommerce_api.streaming import csv_writer
+from inventory import ledger, striping
+from inventory.models import ReservedStock
+from products.cache import invalidate_catalog
+from products.models import Category, Product
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ['sku', 'name', 'description', 'category', 'price', 'stock_quantity', 'weight', 'dimensions']
+UPDATE_FIELDS = ['name', 'description', 'category', 'price', 'stock_quantity', 'weight', 'dimensions', 'updated_at']
+
+
+class ProductImportSerializer(serializers.Serializer):
+    # Validates a single row without touching the database, categories are checked once per batch.
+    # Optional columns left out keep their current value on update and the model default on create.
+    sku = serializers.CharField(max_length=64)
+    name = serializers.CharField(max_length=200)
+    description = serializers.CharField()
+    category = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    stock_quantity = serializers.IntegerField(min_value=0, required=False)
+    weight = serializers.CharField(max_length=50, allow_blank=True, required=False)
+    dimensions = serializers.CharField(max_length=50, allow_blank=True, required=False)
+
+
+class ImportReport:
+    def __init__(self, max_errors=1000):
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def add_error(self, row, errors):
+        self.error_count += 1
+        if self.max_errors is None or len(self.errors) < self.max_errors:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        return {'created': self.created, 'updated': self.updated, 'error_count': self.error_count,
+                'errors': self.errors}
+
+
+def read_rows(lines, file_format):
+    # Yields (row number, row) from an iterable of text lines, one record at a time
+    if file_format == 'csv':
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            # Empty cells count as missing values, cells beyond the header are ignored
+            yield number, {key: value for key, value in row.items() if key is not None and value != ''}
+    else:
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                row = exc
+            yield number, row
+
+
+def import_products(rows, batch_size=1000, report=None):
+    # Upserts products keyed on their SKU, one bulk_create and one bulk_update per batch of rows.
+    # Invalid rows are reported and skipped, they never abort the import.
+    report = report or ImportReport()
+    batch = []
+    for number, row in rows:
+        batch.append((number, row))
+        if len(batch) >= batch_size:
+            import_batch(batch, report)
+            batch = []
+    if batch:
+        import_batch(batch, report)
+    return report
+
+
+def import_batch(batch, report):
+    valid = {}
+    for number, row in batch:
+        if not isinstance(row, dict):
+            report.add_error(number, {'row': [f'Invalid record: {row}']})
+            continue
+        serializer = ProductImportSerializer(data=row)
+        if serializer.is_valid():
+            # A SKU repeated within the batch is applied once, the last row wins like it does across batches
+            valid[serializer.validated_data['sku']] = (number, serializer.validated_data)
+        else:
+            report.add_error(number, serializer.errors)
+
+    category_ids = {data['category'] for number, data in valid.values()}
+    known_categories = set(Category.objects.filter(pk__in=category_ids).values_list('pk', flat=True))
+
+    with transaction.atomic():
+        # Locked, so the stock adjustments recorded in the ledger are relative to the stock actually replaced
+        existing = {product.sku: product for product in Product.objects.select_for_update().filter(sku__in=valid)}
+        held = dict(ReservedStock.objects.filter(product__in=existing.values()).values_list('product_id', 'quantity'))
+        to_create, to_update = [], []
+        previous = {}
+        now = timezone.now()
+        for sku, (number, data) in valid.items():
+            if data['category'] not in known_categories:
+                report.add_error(number, {'category': [f'Category {data["category"]} does not exist.']})
+                continue
+            product = existing.get(sku)
+            if product is not None and data.get('stock_quantity', product.stock_quantity) < held.get(product.pk, 0):
+                report.add_error(number, {'stock_quantity': [
+                    f'Stock cannot be set below the {held[product.pk]} units reserved by carts.']})
+                continue
+            data['category_id'] = data.pop('category')
+            if product is None:
+                to_create.append(Product(**data))
+            else:
+                previous[product.pk] = product.stock_quantity
+                for field, value in data.items():
+                    setattr(product, field, value)
+                product.updated_at = now
+                to_update.append(product)
+
+        Product.objects.bulk_create(to_create)
+        Product.objects.bulk_update(to_update, UPDATE_FIELDS)
+        for product in to_update:
+            if product.stock_shards:
+                # The imported stock replaces the shards' total
+                previous[product.pk] = striping.stripe(product, product.stock_shards, product.stock_quantity)
+        adjustments = {product.pk: product.stock_quantity for product in to_create}
+        adjustments.update((product.pk, product.stock_quantity - previous[product.pk]) for product in to_update)
+        ledger.record(ledger.ADJUST, adjustments)
+        if to_create or to_update:
+            # Bulk operations send no signals
+            invalidate_catalog()
+
+    report.created += len(to_create)
+    report.updated += len(to_update)
+
+
+def export_lines(file_format, chunk_size=2000):
+    # Yields the whole catalog as CSV or JSON lines while holding a single chunk of rows in memory
+    rows = Product.objects.order_by('pk').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    if file_format == 'csv':
+        writer = csv_writer()
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row)), default=str) + '\n'
@@ -0,0 +1,38 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import importer
+
+
+class Command(BaseCommand):
+    help = 'Streams products from a CSV or JSONL file and upserts them by SKU in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, "-" reads from standard input.')
+        parser.add_argument('--file-format', choices=importer.FORMATS,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in importer.FORMATS:
+            raise CommandError(f'Cannot guess the format of {path}, use --file-format.')
+
+        if path == '-':
+            report = self.run(sys.stdin, file_format, options['batch_size'])
+        else:
+            with open(path, encoding='utf-8-sig', newline='') as lines:
+                report = self.run(lines, file_format, options['batch_size'])
+
+        for error in report.errors:
+            self.stderr.write(json.dumps(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'{report.created} created, {report.updated} updated, {report.error_count} rejected.'))
+
+    def run(self, lines, file_format, batch_size):
+        # No cap on the reported errors, they are written out one per line
+        report = importer.ImportReport(max_errors=None)
+        return importer.import_products(importer.read_rows(lines, file_format), batch_size, report)
@@ -1,9 +1,14 @@
 from django.db import models
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from products.cache import invalidate_stock
 
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -13,24 +18,81 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    # Stable identifier used to match rows of the bulk import/export, unique when set
+    sku = models.CharField(max_length=64, null=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.PositiveIntegerField(default=0)
+    # Number of counters the stock is split into for hot products (inventory/striping.py), None for a single counter.
+    # Nullable without a default, so SQLite adds the column without rebuilding the table and its search triggers.
+    stock_shards = models.PositiveSmallIntegerField(null=True, blank=True)
     weight = models.CharField(max_length=50, blank=True)
     dimensions = models.CharField(max_length=50, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # Conditional, so SQLite can add it as a unique index without rebuilding the table
+            models.UniqueConstraint(fields=['sku'], condition=Q(sku__isnull=False), name='products_product_unique_sku'),
+        ]
+        indexes = [
+            # Catalog filtered by category and price range (search_products)
+            models.Index(fields=['category', 'price'], name='products_product_cat_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
-    def reduce_stock(self, quantity):
-        if self.stock_quantity >= quantity:
-            self.stock_quantity -= quantity
-            self.save()
-            return True
-        return False
+    @classmethod
+    def increase_stock_bulk(cls, quantities):
+        # quantities maps product id -> quantity to add back, applied with a single UPDATE
+        if not quantities:
+            return
+        striped = dict(cls.objects.filter(pk__in=quantities, stock_shards__isnull=False)
+                       .values_list('pk', 'stock_shards'))
+        if striped:
+            from inventory import striping
+            for product_id, shards in striped.items():
+                striping.give(product_id, shards, quantities[product_id])
+        whens = [When(pk=product_id, then=F('stock_quantity') + quantity)
+                 for product_id, quantity in quantities.items() if product_id not in striped]
+        if whens:
+            cls.objects.filter(pk__in=quantities, stock_shards__isnull=True).update(
+                stock_quantity=Case(*whens, default=F('stock_quantity'), output_field=models.PositiveIntegerField()),
+                updated_at=timezone.now())
+        invalidate_stock(quantities)
 
-    def increase_stock(self, quantity):
-        self.stock_quantity += quantity
-        self.save()
+    @classmethod
+    def reduce_stock_bulk(cls, quantities, striped=None, held=None):
+        # quantities maps product id -> quantity to remove. Runs as a single conditional UPDATE and
+        # returns False if any product lacked stock; callers must roll back their transaction in that case.
+        # striped maps the striped products among them to their number of shards, they are taken from their shards.
+        # held maps product id -> part of its quantity the caller had reserved (inventory/reservations.py), which is
+        # already known to be in stock and isn't checked again.
+        if not quantities:
+            return True
+        # Products missing from quantities have nothing taken, even when striped
+        striped = {product_id: shards for product_id, shards in (striped or {}).items() if product_id in quantities}
+        if striped:
+            from inventory import striping
+            for product_id, shards in striped.items():
+                if not striping.take(product_id, shards, quantities[product_id]):
+                    return False
+        held = held or {}
+        condition = Q()
+        whens = []
+        for product_id, quantity in quantities.items():
+            if product_id not in striped:
+                unheld = quantity - held.get(product_id, 0)
+                condition |= Q(pk=product_id, stock_quantity__gte=unheld) if unheld > 0 else Q(pk=product_id)
+                whens.append(When(pk=product_id, then=F('stock_quantity') - quantity))
+        updated = 0
+        if whens:
+            # A striped product missing from striped fails the check instead of losing its shards' count
+            updated = cls.objects.filter(condition, stock_shards__isnull=True).update(
+                stock_quantity=Case(*whens, default=F('stock_quantity'), output_field=models.PositiveIntegerField()),
+                updated_at=timezone.now())
+        invalidate_stock(quantities)
+        return updated + len(striped) == len(quantities)
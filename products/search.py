@@ -0,0 +1,40 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+
+def fts5_query(text):
+    # Quote every word so user input can't be read as FTS5 syntax, and match them as prefixes
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+def full_text_search(queryset, text):
+    # Full-text filter on name/description, annotated with a relevance rank (higher is better) and
+    # ordered by it. Served by the index created in migration 0003_product_search_index.
+    vendor = connection.vendor
+
+    if vendor == 'sqlite':
+        query = fts5_query(text)
+        if not query:
+            return queryset.none()
+        matches = RawSQL('SELECT rowid FROM products_product_fts WHERE products_product_fts MATCH %s', [query])
+        # bm25() is lower for better matches; the rowid lookup keeps the rank per result row cheap
+        rank = RawSQL('SELECT -bm25(products_product_fts) FROM products_product_fts '
+                      'WHERE products_product_fts MATCH %s AND rowid = products_product.id',
+                      [query], output_field=FloatField())
+        return queryset.filter(pk__in=matches).annotate(rank=rank).order_by('-rank', 'pk')
+
+    if vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('english', %s)"
+        matches = RawSQL(f'products_product.search_vector @@ {tsquery}', [text], output_field=BooleanField())
+        rank = RawSQL(f'ts_rank(products_product.search_vector, {tsquery})', [text], output_field=FloatField())
+        return queryset.filter(matches).annotate(rank=rank).order_by('-rank', 'pk')
+
+    # Other databases have no index, fall back to a plain scan
+    words = re.findall(r'\w+', text)
+    condition = Q()
+    for word in words:
+        condition &= Q(name__icontains=word) | Q(description__icontains=word)
+    return queryset.filter(condition).order_by('pk') if words else queryset.none()
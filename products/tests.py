@@ -0,0 +1,87 @@
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from cart.models import Cart
+from inventory import reservations
+from products.cache import bump_catalog_version, get_catalog_version
+from products.models import Category, Product
+from products.search import full_text_search
+
+
+class ReservedStockTests(TestCase):
+    def setUp(self):
+        admin = CustomUser.objects.create_user(username='admin', email='admin@example.com', password='password',
+                                               is_staff=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=admin).key}')
+        self.category = Category.objects.create(name='Category')
+        self.product = Product.objects.create(name='Product', description='Product', category=self.category,
+                                              price='10.00', stock_quantity=5, sku='SKU-1')
+        customer = CustomUser.objects.create_user(username='customer', email='customer@example.com',
+                                                  password='password')
+        self.assertTrue(reservations.reserve(Cart.objects.create(user=customer).pk, self.product.pk, 3))
+
+    def update(self, stock):
+        return self.client.put(f'/store/products/update/{self.product.pk}/', {
+            'name': 'Product', 'description': 'Product', 'category': self.category.pk, 'price': '10.00',
+            'stock_quantity': stock}, format='json')
+
+    def test_update_cannot_take_held_stock(self):
+        response = self.update(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Stock cannot be set below the 3 units reserved by carts')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 5)
+
+        self.assertEqual(self.update(3).status_code, 200)
+        self.assertEqual(reservations.available(self.product.pk), 0)
+
+    def test_import_cannot_take_held_stock(self):
+        upload = SimpleUploadedFile('products.jsonl', (
+            f'{{"sku": "SKU-1", "name": "Product", "description": "Product", "category": {self.category.pk}, '
+            f'"price": "10.00", "stock_quantity": 2}}\n').encode())
+        response = self.client.post('/store/products/import/', {'file': upload})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 0)
+        self.assertEqual(response.data['error_count'], 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 5)
+
+
+class CatalogVersionTests(TestCase):
+    def test_bump_sets_a_new_version(self):
+        cache.clear()
+        bump_catalog_version()
+        versions = {get_catalog_version()}
+        for _ in range(3):
+            bump_catalog_version()
+            versions.add(get_catalog_version())
+        self.assertEqual(len(versions), 4)
+
+
+class SearchIndexTests(TestCase):
+    def search(self, text):
+        return list(full_text_search(Product.objects.all(), text).values_list('name', flat=True))
+
+    def test_index_follows_the_products(self):
+        # On SQLite the index is kept in sync by triggers, which a migration rebuilding products_product would drop
+        category = Category.objects.create(name='Category')
+        product = Product.objects.create(name='Walnut desk', description='Solid wood', category=category,
+                                         price='10.00', stock_quantity=1)
+        self.assertEqual(self.search('walnut'), ['Walnut desk'])
+        self.assertEqual(self.search('wood'), ['Walnut desk'])
+
+        product.name = 'Oak desk'
+        product.save()
+        self.assertEqual(self.search('walnut'), [])
+        self.assertEqual(self.search('oak'), ['Oak desk'])
+
+        Product.objects.filter(pk=product.pk).update(description='Painted steel')
+        self.assertEqual(self.search('wood'), [])
+        self.assertEqual(self.search('steel'), ['Oak desk'])
+
+        product.delete()
+        self.assertEqual(self.search('oak'), [])
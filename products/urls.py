@@ -1,6 +1,6 @@
 from django.urls import path
 
-from products import views
+from products import async_views, views
 
 urlpatterns = [
     path('categories/', views.CategoryListView.as_view(), name='category-list'),
@@ -9,7 +9,16 @@ urlpatterns = [
     path('categories/delete/<int:pk>/', views.delete_category, name='delete-category'),
 
     path('products/', views.ProductListView.as_view(), name='product-list'),
+    path('products/search/', views.search_products, name='product-search'),
     path('products/create/', views.create_product, name='product-create'),
+    path('products/import/', views.import_products, name='product-import'),
+    path('products/export/', views.export_products, name='product-export'),
     path('products/update/<int:pk>/', views.update_product, name='update-product'),
     path('products/delete/<int:pk>/', views.delete_product, name='delete-product'),
 ]
+
+# Served by the ASGI application in front of the sync views, see ecommerce_api/urls_asgi.py
+async_urlpatterns = [
+    path('categories/', async_views.category_list, name='category-list'),
+    path('products/', async_views.product_list, name='product-list'),
+] + urlpatterns
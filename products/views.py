@@ -1,57 +1,150 @@
+import codecs
+
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
+from accounts.authentication import CachedTokenAuthentication
+from ecommerce_api.replicas import replica_reads
+from inventory import ledger, reservations, striping
+from products import importer
+from products.cache import CatalogCacheMixin
 from products.models import Category, Product
-from products.serializers import CategorySerializer, ProductSerializer, SimpleProductSerializer
+from products.search import full_text_search
+from products.serializers import CategorySerializer, ProductSerializer, SimpleProductSerializer, \
+    ProductSearchSerializer
 
 
-class CategoryListView(generics.ListAPIView):
+class CategoryListView(CatalogCacheMixin, generics.ListAPIView):
+    cache_name = 'categories'
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
 
 
-class ProductListView(generics.ListAPIView):
-    queryset = Product.objects.all()
+class ProductListView(CatalogCacheMixin, generics.ListAPIView):
+    cache_name = 'products'
+    live_stock = True
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
+
+
+@api_view(["GET"])
+@authentication_classes([CachedTokenAuthentication])
+@replica_reads('catalog')
+def search_products(request):
+    params = ProductSearchSerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+    filters = params.validated_data
+
+    products = Product.objects.select_related('category')
+    if filters.get('category') is not None:
+        products = products.filter(category_id=filters['category'])
+    if filters.get('min_price') is not None:
+        products = products.filter(price__gte=filters['min_price'])
+    if filters.get('max_price') is not None:
+        products = products.filter(price__lte=filters['max_price'])
+    if filters['in_stock']:
+        products = products.filter(stock_quantity__gt=0)
+
+    if filters.get('q', '').strip():
+        # Best matches first, the full-text index restricts the scan to the matching products
+        products = full_text_search(products, filters['q'])
+    else:
+        products = products.order_by('pk')
+
+    serializer = ProductSerializer(products[:filters['limit']], many=True)
+    return Response({'results': serializer.data}, status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def create_product(request):
     serializer = SimpleProductSerializer(
         data=request.data)  # Using a different serializer that doesn't require Category object but only its id
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            product = serializer.save()
+            # The initial stock is the first movement of the product's ledger
+            ledger.record(ledger.ADJUST, {product.pk: product.stock_quantity})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(["POST"])
+@login_required
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdminUser])
+def import_products(request):
+    upload = request.FILES.get('file')
+    if not upload:
+        return Response({'error': 'A CSV or JSONL file is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    file_format = request.data.get('file_format') or upload.name.rsplit('.', 1)[-1].lower()
+    if file_format not in importer.FORMATS:
+        return Response({'error': f'Unsupported format. Valid choices are: {", ".join(importer.FORMATS)}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    # The upload is decoded and parsed line by line, the rows are upserted in batches
+    lines = codecs.iterdecode(upload, 'utf-8-sig')
+    report = importer.import_products(importer.read_rows(lines, file_format))
+    return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@login_required
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdminUser])
+def export_products(request):
+    file_format = request.query_params.get('file_format', 'csv')
+    if file_format not in importer.FORMATS:
+        return Response({'error': f'Unsupported format. Valid choices are: {", ".join(importer.FORMATS)}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(importer.export_lines(file_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+    return response
+
+
 @api_view(["PUT"])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def update_product(request, pk):
-    product = get_object_or_404(Product, pk=pk)
-    serializer = SimpleProductSerializer(product, data=request.data)
-    if serializer.is_valid():
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    with transaction.atomic():
+        # Locked, so a sale committing between reading the stock and saving the new one can't be lost
+        product = get_object_or_404(Product.objects.select_for_update(), pk=pk)
+        previous = product.stock_quantity
+        serializer = SimpleProductSerializer(product, data=request.data)
+        if serializer.is_valid():
+            # The carts' holds must stay covered, or their checkouts would fail
+            held = reservations.reserved(product.pk)
+            if serializer.validated_data.get('stock_quantity', previous) < held:
+                return Response({'error': f'Stock cannot be set below the {held} units reserved by carts'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            serializer.save()
+            if product.stock_shards:
+                # The new stock replaces the shards' total
+                previous = striping.stripe(product, product.stock_shards, product.stock_quantity)
+            ledger.record(ledger.ADJUST, {product.pk: product.stock_quantity - previous})
+            return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(["DELETE"])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def delete_product(request, pk):
     product = get_object_or_404(Product, pk=pk)
@@ -61,7 +154,7 @@ def delete_product(request, pk):
 
 @api_view(["POST"])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def create_category(request):
     serializer = CategorySerializer(data=request.data)
@@ -73,7 +166,7 @@ def create_category(request):
 
 @api_view(["PUT"])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def update_category(request, pk):
     category = get_object_or_404(Category, pk=pk)
@@ -86,7 +179,7 @@ def update_category(request, pk):
 
 @api_view(["DELETE"])
 @login_required
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdminUser])
 def delete_category(request, pk):
     category = get_object_or_404(Category, pk=pk)
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from tasks.queue import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued background tasks, in batches. Polls forever unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of tasks claimed at a time.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait before polling again once the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Run the due tasks and exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            done = run_pending(options['batch_size'])
+            if done:
+                self.stdout.write(f'Ran {done} tasks.')
+            if options['once']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,26 @@
+from django.db import models
+from django.utils import timezone
+
+
+# A queued call of a function decorated with @task (tasks/queue.py). A claimed task is hidden by moving its run_at past
+# the lease, so a worker dying mid-task leaves it to be claimed again once the lease ends.
+class Task(models.Model):
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    # Token of the claim that took the task last, so each worker reads back exactly the tasks its UPDATE took
+    claim = models.UUIDField(null=True)
+    # Set once the task has failed TASK_MAX_ATTEMPTS times, it is then kept for inspection and never run again
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Due tasks, oldest first (claim). Partial, as the failed ones are never claimed again.
+            models.Index(fields=['run_at'], condition=models.Q(failed=False), name='tasks_task_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}{tuple(self.args)}"
@@ -0,0 +1,137 @@
+import logging
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from tasks.models import Task
+
+# A small task queue on the Task table. Tasks are enqueued inside the caller's transaction, so they exist only if it
+# commits, and are delivered at least once: a task is deleted in the same transaction as the work it did, and retried
+# with an exponential backoff when it raises, up to TASK_MAX_ATTEMPTS times.
+
+logger = logging.getLogger(__name__)
+
+
+def task(batched=False):
+    # Makes func enqueueable with func.enqueue(*args), the arguments must be JSON serializable.
+    # A batched task is called once per batch of claimed tasks, with the list of their arguments.
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__name__}'
+        func.batched = batched
+        func.enqueue = lambda *args: enqueue(func.task_name, list(args))
+        return func
+
+    return decorator
+
+
+def enqueue(name, args):
+    Task.objects.create(name=name, args=args)
+    if settings.TASK_EXECUTOR == 'thread':
+        transaction.on_commit(lambda: get_executor().submit(drain))
+
+
+_executor = None
+
+
+def get_executor():
+    # Created on first use, so each forked Gunicorn worker gets its own threads
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.TASK_THREADS, thread_name_prefix='tasks')
+    return _executor
+
+
+def drain():
+    try:
+        run_pending()
+    except Exception:
+        logger.exception('Running the queued tasks failed')
+    finally:
+        connections.close_all()
+
+
+def claim(batch_size):
+    # Claims up to batch_size due tasks by moving them past the lease. The UPDATE only takes the tasks that are still
+    # due, so of two workers selecting the same tasks only one gets each of them, and stamps them with a token of its
+    # own to read them back: two workers can compute the same lease, the token is never shared.
+    now = timezone.now()
+    token = uuid.uuid4()
+    due = list(Task.objects.filter(failed=False, run_at__lte=now).order_by('run_at')
+               .values_list('pk', flat=True)[:batch_size])
+    if not due:
+        return []
+    Task.objects.filter(pk__in=due, failed=False, run_at__lte=now).update(
+        run_at=now + timedelta(seconds=settings.TASK_LEASE), attempts=F('attempts') + 1, claim=token)
+    return list(Task.objects.filter(pk__in=due, claim=token).order_by('run_at', 'pk'))
+
+
+def run_pending(batch_size=100):
+    # Runs the due tasks, a batch at a time, until none is left. Returns the number of tasks run.
+    done = 0
+    while True:
+        batch = claim(batch_size)
+        if not batch:
+            return done
+        run_batch(batch)
+        done += len(batch)
+
+
+def run_batch(batch):
+    groups = defaultdict(list)
+    for queued in batch:
+        groups[queued.name].append(queued)
+    for name, queued_tasks in groups.items():
+        try:
+            func = import_string(name)
+        except ImportError as exc:
+            retry(queued_tasks, exc)
+            continue
+        if func.batched:
+            run_batched(func, queued_tasks)
+        else:
+            for queued in queued_tasks:
+                run(func, [queued], lambda: func(*queued.args))
+
+
+def run_batched(func, queued_tasks):
+    # A batch runs in a single transaction, so one bad call would fail all of them: when the batch fails each call is
+    # run on its own, and only the ones that fail again are retried
+    if len(queued_tasks) == 1:
+        run(func, queued_tasks, lambda: func([queued_tasks[0].args]))
+        return
+    try:
+        with transaction.atomic():
+            func([queued.args for queued in queued_tasks])
+            Task.objects.filter(pk__in=[queued.pk for queued in queued_tasks]).delete()
+    except Exception:
+        logger.exception('Batch of %d %s tasks failed, running them one by one', len(queued_tasks), func.task_name)
+        for queued in queued_tasks:
+            run(func, [queued], lambda: func([queued.args]))
+
+
+def run(func, queued_tasks, call):
+    try:
+        with transaction.atomic():
+            call()
+            Task.objects.filter(pk__in=[queued.pk for queued in queued_tasks]).delete()
+    except Exception as exc:
+        logger.exception('Task %s failed', func.task_name)
+        retry(queued_tasks, exc)
+
+
+def retry(queued_tasks, exc):
+    now = timezone.now()
+    for queued in queued_tasks:
+        queued.last_error = repr(exc)
+        if queued.attempts >= settings.TASK_MAX_ATTEMPTS:
+            queued.failed = True
+        else:
+            queued.run_at = now + timedelta(seconds=2 ** queued.attempts)
+    Task.objects.bulk_update(queued_tasks, ['last_error', 'failed', 'run_at'])